@@ -1,7 +1,8 @@
-from face_hnfnu.net import build_model
-import torch
+import time
+from face_hnfnu import metrics
+from face_hnfnu.backend import InferenceBackend, create_backend
+from face_hnfnu.preprocess import InputBuffer, decode_image, resize_max
 import numpy as np
-from PIL import Image
 from face_hnfnu.Config import ConfigModel
 from yuface import detect
 import cv2
@@ -87,55 +88,79 @@ class AdaFaceFeature:
 
     def __init__(self, config: ConfigModel) -> None:
         """初始化配置"""
-        self.adaface_config = config.ADAFACE_MODEL
-        self.adaface_models = {config.ADAFACE_MODEL: config.ADAFACE_MODEL_FILE}
+        self.config = config
+        self.backend: InferenceBackend = create_backend(config)
+        self.input_buffer = InputBuffer(max_batch_size=config.BATCH_MAX_SIZE)
+
+    @property
+    def accuracy_report(self) -> dict | None:
+        """非 fp32 精度模式下与 fp32 特征向量的对比报告"""
+        return self.backend.accuracy_report
 
     def load_pretrained_model(self):
         """加载模型"""
-
-        # load model and pretrained statedict
-        architecture = self.adaface_config
-        assert architecture in self.adaface_models.keys()
-        model = build_model(architecture)
-        statedict = torch.load(
-            self.adaface_models[architecture], map_location=torch.device("cpu"), weights_only=True
-        )["state_dict"]
-        model_statedict = {
-            key[6:]: val for key, val in statedict.items() if key.startswith("model.")
-        }
-        model.load_state_dict(model_statedict)
-        model.eval()
-        self.model = model
+        self.backend.load()
         return self
 
-    def to_input(self, pil_rgb_image):
-        """PIL RGB图像对象转换为PyTorch模型的输入张量"""
-        np_img = np.array(pil_rgb_image)
-        brg_img = ((np_img[:, :, ::-1] / 255.0) - 0.5) / 0.5
-        # tensor = torch.tensor([brg_img.transpose(2, 0,1)]).float()
-        tensor = torch.tensor(np.array([brg_img.transpose(2, 0, 1)])).float()
-        return tensor
+    def to_batch_input(self, bgr_faces: np.ndarray | list[np.ndarray]) -> np.ndarray:
+        """(N, 112, 112, 3) 的 BGR 对齐人脸写入预分配的模型输入缓冲区"""
+        return self.input_buffer.to_input(bgr_faces)
+
+    def decode(self, data) -> np.ndarray:
+        """将图像字节解码为用于对齐的 BGR 数组，最长边不超过 align_max_size"""
+        return decode_image(data, max_size=self.config.ALIGN_MAX_SIZE)
+
+    def detect_faces(self, np_image: np.ndarray) -> tuple:
+        """
+        检测图像中置信度不低于阈值的人脸，按置信度从高到低排列
+        检测在最长边不超过 detect_max_size 的缩小图上进行，坐标映射回 np_image
+        Returns:
+        tuple: (confs (N,), bboxes (N, 4) 的 x1, y1, x2, y2, landmarks (N, 10))
+        """
+        detect_image, scale = resize_max(np_image, self.config.DETECT_MAX_SIZE)
+        start = time.perf_counter()
+        confs, bboxes, landmarks = detect(detect_image, conf=self.config.DETECT_CONFIDENCE)
+        metrics.DETECT_SECONDS.observe(time.perf_counter() - start)
+        if len(bboxes) == 0:
+            raise ValueError("未检测到人脸")
+        confs = np.asarray(confs, dtype=np.float32).reshape(-1)
+        order = np.argsort(-confs)[: self.config.MAX_FACES]
+        bboxes = np.asarray(bboxes, dtype=np.float32)[order]
+        bboxes[:, 2:] += bboxes[:, :2]  # yuface 返回 x, y, w, h，统一为 x1, y1, x2, y2
+        landmarks = np.asarray(landmarks).reshape(len(confs), -1)[order]
+        if scale != 1.0:
+            bboxes = bboxes / scale
+            landmarks = landmarks / scale
+        return confs[order], bboxes, landmarks
 
-    def byte_get_represent(self, image: Image.Image):
+    def align_faces(self, np_image: np.ndarray, bboxes, landmarks) -> np.ndarray:
+        """逐个对齐人脸，返回 (N, 112, 112, 3) 的人脸图像"""
+        faces = []
+        for bbox, landmark in zip(bboxes, landmarks):
+            start = time.perf_counter()
+            faces.append(
+                FaceAlignment.align_process(np_image, bbox, landmark, image_size=[112, 112])
+            )
+            metrics.ALIGN_SECONDS.observe(time.perf_counter() - start)
+        return np.stack(faces)
+
+    def detect_and_align(self, np_image: np.ndarray) -> np.ndarray:
+        """检测并对齐置信度最高的人脸，返回 112x112 的 BGR 人脸图像"""
+        _confs, bboxes, landmarks = self.detect_faces(np_image)
+        return self.align_faces(np_image, bboxes[:1], landmarks[:1])[0]
+
+    def batch_get_represent(self, aligned_bgr_imgs: np.ndarray | list[np.ndarray]) -> np.ndarray:
+        """批量获取对齐人脸的特征向量，返回 (N, 512) 的 float32 数组"""
+        batch = self.to_batch_input(aligned_bgr_imgs)
+        start = time.perf_counter()
+        features = self.backend(batch)
+        metrics.FORWARD_SECONDS.observe(time.perf_counter() - start)
+        return features
+
+    def byte_get_represent(self, data) -> np.ndarray:
         """获取脸部特征向量"""
         try:
-            w, h = image.size
-            if w > 960 or h > 960:
-                if w < h:
-                    aspect_ratio = w / h
-                    image.thumbnail((960 * aspect_ratio, 960))
-                else:
-                    aspect_ratio = h / w
-                    image.thumbnail((960, 960 * aspect_ratio))
-            _conf, bboxes, landmark = detect(np.array(image), conf=0.75)
-            if len(bboxes) == 0:
-                raise ValueError("未检测到人脸")
-            aligned_rgb_img = FaceAlignment.align_process(
-                np.array(image), bboxes, landmark, image_size=[112, 112]
-            )
-            bgr_tensor_input = self.to_input(aligned_rgb_img)
-            if bgr_tensor_input is not None:
-                feature, _ = self.model(bgr_tensor_input)
-            return feature
+            aligned_bgr_img = self.detect_and_align(self.decode(data))
+            return self.batch_get_represent(aligned_bgr_img[np.newaxis])
         except Exception as err:
             raise ValueError(f"无法提取脸部特征向量, caused by:{err}") from err
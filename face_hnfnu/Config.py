@@ -4,6 +4,8 @@ from pydantic import BaseModel, Field
 # Paths
 FAISS_DATABASE_PATH = Path.cwd() / "data" / "face_db.index"
 INDEX_DATABASE_PATH = Path.cwd() / "data" / "face_db.sqlite"
+MODEL_CACHE_PATH = Path.cwd() / "data" / "model_cache"
+CALIBRATION_PATH = Path.cwd() / "data" / "calibration"
 SERVER_CONFIG_PATH = Path.cwd() / "config" / "config.json"
 
 
@@ -14,14 +16,96 @@ class ConfigModel(BaseModel):
     ADAFACE_MODEL_FILE: str = Field(
         default="models/adaface_ir18_webface4m.ckpt", alias="adaface_model_file"
     )
+    INFERENCE_BACKEND: str = Field(
+        default="torch", alias="inference_backend"
+    )  # torch / onnx / openvino
+    ONNX_MODEL_FILE: str = Field(
+        default="", alias="onnx_model_file"
+    )  # 置空则使用与 checkpoint 同名的 .onnx 文件
+    MODEL_CACHE_PATH: str = Field(
+        default=MODEL_CACHE_PATH.as_posix(), alias="model_cache_path"
+    )  # 置空则不使用模型缓存
+    ADAFACE_FUSE: bool = Field(default=True, alias="adaface_fuse")
+    ADAFACE_JIT: bool = Field(default=False, alias="adaface_jit")
+    INFERENCE_PRECISION: str = Field(
+        default="fp32", alias="inference_precision"
+    )  # fp32 / bf16 / int8
+    CALIBRATION_PATH: str = Field(
+        default=CALIBRATION_PATH.as_posix(), alias="calibration_path"
+    )  # int8 校准用的已对齐人脸目录
+    ALIGN_MAX_SIZE: int = Field(default=960, alias="align_max_size")  # 用于对齐的图像最长边
+    DETECT_MAX_SIZE: int = Field(default=640, alias="detect_max_size")  # 用于检测的图像最长边
+    DETECT_CONFIDENCE: float = Field(default=0.75, alias="detect_confidence")
+    MAX_FACES: int = Field(default=16, alias="max_faces")  # 多人脸模式下每张图最多处理的人脸数
     FAISS_DATABASE_PATH: str = Field(
         default=FAISS_DATABASE_PATH.as_posix(), alias="faiss_database_path"
     )
     INDEX_DATABASE_PATH: str = Field(
         default=INDEX_DATABASE_PATH.as_posix(), alias="index_database_path"
     )
+    COMPACT_TOMBSTONES: int = Field(
+        default=1000, alias="compact_tombstones"
+    )  # 已删除向量达到该数量时重建 Faiss 索引
+    INDEX_FACTORY: str = Field(
+        default="auto", alias="index_factory"
+    )  # Faiss factory 字符串，例如 "HNSW32,Flat"、"IVF1024,PQ64"；"auto" 按库容量选择
+    INDEX_PARAMS: str = Field(
+        default="", alias="index_params"
+    )  # 检索参数，例如 "efSearch=64,nprobe=16"
+    INDEX_EF_CONSTRUCTION: int = Field(default=0, alias="index_ef_construction")  # 0 为 Faiss 默认值
+    INDEX_TRAIN_SIZE: int = Field(
+        default=0, alias="index_train_size"
+    )  # 开始训练所需的最少向量数，0 为按索引类型估算，不足时先用 Flat
+    INDEX_TRAIN_SAMPLE: int = Field(default=100_000, alias="index_train_sample")  # 训练采样数
+    INDEX_MMAP: bool = Field(
+        default=False, alias="index_mmap"
+    )  # 只读 mmap 加载快照，第一次写入时才载入私有内存
+    INDEX_READ_ONLY: bool = Field(
+        default=False, alias="index_read_only"
+    )  # 只读副本，与写入进程共享快照与日志，快照更新后自动热切换
+    SNAPSHOT_INTERVAL: float = Field(default=300.0, alias="snapshot_interval")  # 后台快照间隔(秒)
+    SNAPSHOT_OPS: int = Field(
+        default=10000, alias="snapshot_ops"
+    )  # 增删日志达到该条数时提前写入快照
+    OPLOG_FSYNC: bool = Field(
+        default=False, alias="oplog_fsync"
+    )  # 每条日志 fsync，关闭时只防进程崩溃，不防断电
+    SEARCH_OVERSAMPLE: int = Field(
+        default=4, alias="search_oversample"
+    )  # 按身份聚合检索时每个查询取 k * search_oversample 个候选
     SIMILARITY_THRESHOLD: float = Field(default=-1000, alias="threshold")
     THREAD_COUNT: int = Field(default=4, alias="thread_count")
+    INFERENCE_MODE: str = Field(default="thread", alias="inference_mode")
+    TORCH_THREADS: int = Field(
+        default=0, alias="torch_threads"
+    )  # 推理库的算子内线程数，0 为推理库默认(每个核心一个)；进程池模式下每个工作进程默认为 1
+    INFERENCE_QUEUE_SIZE: int = Field(default=64, alias="inference_queue_size")
+    BATCH_MAX_SIZE: int = Field(default=16, alias="batch_max_size")
+    BATCH_MAX_WAIT_MS: float = Field(default=5.0, alias="batch_max_wait_ms")
+    EMBEDDING_CACHE_BYTES: int = Field(
+        default=64 * 1024 * 1024, alias="embedding_cache_bytes"
+    )  # 按图像内容哈希缓存特征向量的字节上限，0 为关闭
+    EMBEDDING_CACHE_TTL: float = Field(default=300.0, alias="embedding_cache_ttl")  # 缓存有效期(秒)
+    TRACK_IOU_THRESHOLD: float = Field(default=0.3, alias="track_iou_threshold")  # 检测框关联轨迹的最小 IoU
+    TRACK_REFRESH_SECONDS: float = Field(
+        default=2.0, alias="track_refresh_seconds"
+    )  # 同一轨迹重新推理的间隔
+    TRACK_MAX_AGE_SECONDS: float = Field(
+        default=1.0, alias="track_max_age_seconds"
+    )  # 轨迹多久未出现后丢弃
+    TRACK_QUALITY_GAIN: float = Field(
+        default=0.05, alias="track_quality_gain"
+    )  # 检测置信度比上次推理时高出该值时重新推理
+    BULK_CHUNK_SIZE: int = Field(
+        default=64, alias="bulk_chunk_size"
+    )  # 批量录入时每次推理并写入数据库的图像数量
+    RAW_BODY_MAX_BYTES: int = Field(
+        default=16 * 1024 * 1024, alias="raw_body_max_bytes"
+    )  # /raw 接口请求体的字节上限
 
 
-server_config = ConfigModel().model_validate_json(SERVER_CONFIG_PATH.read_text())
+server_config = (
+    ConfigModel().model_validate_json(SERVER_CONFIG_PATH.read_text())
+    if SERVER_CONFIG_PATH.is_file()
+    else ConfigModel()
+)  # 没有配置文件时(例如运行单元测试)使用默认配置
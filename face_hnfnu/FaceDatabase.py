@@ -1,8 +1,19 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
 import numpy as np
 import faiss
-import sqlite3
 from pathlib import Path
 from face_hnfnu.Config import ConfigModel
+from face_hnfnu.ann_index import AUTO, build_index, create_index, resolve_factory
+from face_hnfnu import metrics
+from face_hnfnu.log import logger
+from face_hnfnu.oplog import OP_ADD, OP_CLEAR, OP_REMOVE, OperationLog
+from face_hnfnu.rwlock import RWLock
+from face_hnfnu.sqlite_pool import SQLiteConnectionManager
 
 
 class FaceDatabase:
@@ -15,39 +26,259 @@ class FaceDatabase:
         self.faiss_path = Path(config.FAISS_DATABASE_PATH)  # 保存 Faiss 数据库路径
         self.index_path = Path(config.INDEX_DATABASE_PATH)  # 保存人脸 id 表路径
         self.dimension = dimension  # 保存人脸向量的维度
+        self.compact_tombstones = config.COMPACT_TOMBSTONES  # 墓碑数量达到该值时自动压缩索引
+        self.index_factory = config.INDEX_FACTORY  # 配置的索引类型，"auto" 按库容量选择
+        self.index_params = config.INDEX_PARAMS
+        self.ef_construction = config.INDEX_EF_CONSTRUCTION
+        self.train_size = config.INDEX_TRAIN_SIZE
+        self.train_sample = config.INDEX_TRAIN_SAMPLE
+        self.search_oversample = config.SEARCH_OVERSAMPLE  # 按身份聚合时多取的候选倍数
+        self.snapshot_interval = config.SNAPSHOT_INTERVAL  # 后台快照间隔(秒)
+        self.snapshot_ops = config.SNAPSHOT_OPS  # 日志记录达到该数量时提前快照
+        self.index_mmap = config.INDEX_MMAP  # 以只读 mmap 加载快照，多个进程共享页缓存
+        self.mmapped = False  # 当前索引是否为只读映射，写入前会先载入私有内存
+        self.rebuilt = False  # 重建后的索引尚未写入快照(重建不写日志)
+        self.read_only = config.INDEX_READ_ONLY  # 只读副本：不写日志与快照，跟随写入进程的快照
+        self.delta = None  # 只读副本中快照之后的新增，快照本身保持只读映射
+        self.snapshot_hidden = False  # 只读副本在日志中读到清空时，快照中的向量全部不可见
+        self._snapshot_mtime = 0
+        self.lock = threading.RLock()  # 写入互斥锁，写入之间串行，检索不需要持有
+        self.rwlock = RWLock()  # 检索持有读锁；写入只在修改内存中的索引与映射时持有写锁
+        self._pending_adds: queue.SimpleQueue = queue.SimpleQueue()  # 等待合并提交的新增
+        self._snapshot_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self.index_version = 0  # 索引被替换或清空时递增，后台重建据此判断是否仍可切换
+        self._snapshot_thread: threading.Thread | None = None
+        self._snapshot_wakeup = threading.Event()
+        self._snapshot_stop = threading.Event()
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        self.sqlite = SQLiteConnectionManager(self.index_path)  # 人脸 id 表的常驻连接
+        self.oplog = OperationLog(
+            self.faiss_path.with_name(self.faiss_path.name + ".log"), fsync=config.OPLOG_FSYNC
+        )  # 快照之后的增删日志
+        self.createTables()
+        row = self.sqlite.fetchone("SELECT value FROM meta WHERE key = 'index_factory_pinned'")
+        self.pinned = row is not None and row[0] == "1"
         if self.faiss_path.is_file():
             self.loadDatabase()  # 从指定路径加载数据库
         else:
-            self.faiss = faiss.IndexHNSWFlat(dimension, dimension // 2, faiss.METRIC_INNER_PRODUCT)# 创建 Faiss 的余弦相似度索引
-        if not self.index_path.is_file():
-            self.index_path.parent.mkdir(parents=True, exist_ok=True)
-            self.index_path.touch(exist_ok=True)
-            self.query_database(
-                "CREATE TABLE ids (id INTEGER PRIMARY KEY NOT NULL, name TEXT UNIQUE);",
-                (),
-            )  # 创建人脸 id 表
+            self.setIndexFactory(self.resolveFactory(0))
+            self.faiss = self.createIndex(self.factory)
+        if self.read_only:
+            self.delta, self.snapshot_hidden = self.readDelta(self.faiss)
+        else:
+            self.replayLog(self.faiss)
+        self.loadIdMap(remove_orphans=not self.read_only)
+
+    def resolveFactory(self, count: int) -> str:
+        """
+        count 个向量应使用的 Faiss factory 字符串，训练样本不足时为 Flat
+        """
+        return resolve_factory(self.index_factory, count, self.train_size)
+
+    def createIndex(self, factory: str):
+        """
+        创建空的 Faiss 余弦相似度索引，外层 IndexIDMap2 保存由 SQLite 分配的 64 位 id
+        """
+        return create_index(self.dimension, factory, self.index_params, self.ef_construction)
+
+    def createTables(self):
+        """
+        创建人脸 id 表；id 使用 AUTOINCREMENT，删除后不会被复用
+        """
+        row = self.sqlite.fetchone("SELECT sql FROM sqlite_master WHERE name = 'ids'")
+        legacy = row is not None and "AUTOINCREMENT" not in row[0].upper()
+        with self.sqlite.transaction() as conn:
+            if legacy:  # 旧版 id 表迁移为 AUTOINCREMENT，保留原有 id
+                conn.execute("ALTER TABLE ids RENAME TO ids_legacy")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ids (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE, identity TEXT);"
+            )  # 创建人脸 id 表，identity 为空时即为 name
+            if legacy:
+                conn.execute("INSERT INTO ids (id, name) SELECT id, name FROM ids_legacy")
+                conn.execute("DROP TABLE ids_legacy")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(ids)")]
+            if "identity" not in columns:  # 旧版 id 表没有身份列
+                conn.execute("ALTER TABLE ids ADD COLUMN identity TEXT")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            )  # 保存当前索引的 factory 字符串等信息
 
-    def addFace(self, face_id, face_vector):
+    def addFace(self, face_id, face_vector, identity: str | None = None):
         """
         将人脸向量添加进数据库
         Parameters:
         face_id: 人脸 id
         face_vector: 人脸向量
+        identity: 所属身份，同一人的多张入库图像使用相同的身份，默认为人脸 id
         """
         if face_vector.shape[1] != self.dimension:
             raise ValueError(
                 "Face vector dimension does not match the database dimension"
             )  # 抛出维度不匹配的异常
-        sql = "INSERT INTO ids (id, name) VALUES (?,?)"
-        query = self.__len__(), str(face_id)
-        self.query_database(sql, query)  # 插入人脸 id 表
-        self.faiss.train(
-            face_vector
-        )
-        self.faiss.add(
-            face_vector
+        self.addFaces(
+            [face_id], face_vector, None if identity is None else [identity]
         )  # 向 Faiss 索引中添加人脸向量
 
+    def addFaces(self, face_ids: list, face_vectors, identities: list | None = None):
+        """
+        批量添加人脸向量，id 由 SQLite 分配
+        并发的新增会排队，由先拿到写入锁的线程合并为一次提交
+        Parameters:
+        face_ids: 人脸 id 列表
+        face_vectors: (N, dimension) 的人脸向量
+        identities: 每个人脸所属的身份，默认为人脸 id
+        """
+        if face_vectors.shape[1] != self.dimension or len(face_ids) != len(face_vectors):
+            raise ValueError(
+                "Face vectors do not match the face ids or the database dimension"
+            )
+        names = [str(face_id) for face_id in face_ids]
+        identities = names if identities is None else [str(identity) for identity in identities]
+        future = Future()
+        self._pending_adds.put((names, identities, face_vectors, future))
+        with self.lock:
+            self.applyPendingAdds()
+        future.result()
+        self.requestSnapshot()
+        self.requestMaintenance()
+
+    def applyPendingAdds(self):
+        """
+        将排队中的所有新增合并为一次 SQLite 事务、一次日志写入和一次 Faiss 写入
+        每个请求使用独立的 SAVEPOINT，人脸 id 重复只会使该请求失败
+        日志在事务提交前写入，写日志失败时 id 表一起回滚；提交后写入索引失败时删除
+        已提交的 id，使这些人脸 id 可以重新录入
+        """
+        requests = []
+        while True:
+            try:
+                requests.append(self._pending_adds.get_nowait())
+            except queue.Empty:
+                break
+        if not requests:
+            return
+        accepted, committed = [], False
+        try:
+            self.ensureWritable()
+            with self.sqlite.transaction() as conn:
+                for names, identities, vectors, future in requests:
+                    conn.execute("SAVEPOINT add_faces")
+                    try:
+                        ids = [
+                            conn.execute(
+                                "INSERT INTO ids (name, identity) VALUES (?, ?)", (name, identity)
+                            ).lastrowid
+                            for name, identity in zip(names, identities)
+                        ]
+                    except sqlite3.Error as err:
+                        conn.execute("ROLLBACK TO add_faces")
+                        future.set_exception(err)
+                    else:
+                        accepted.append((names, identities, vectors, ids, future))
+                    conn.execute("RELEASE add_faces")
+                if not accepted:
+                    return
+                ids = np.array(
+                    [id for *_, request_ids, _ in accepted for id in request_ids], dtype=np.int64
+                )
+                vectors = np.concatenate([vectors for _, _, vectors, _, _ in accepted])
+                self.oplog.append_add(ids, vectors)  # 先写日志再提交 id 表与修改索引
+            committed = True
+            with self.rwlock.write():
+                self.faiss.add_with_ids(vectors, ids)
+                for names, identities, _, request_ids, _ in accepted:
+                    self.id_to_name.update(zip(request_ids, names))
+                    self.name_to_id.update(zip(names, request_ids))
+                    self.id_to_identity.update(zip(request_ids, identities))
+        except BaseException as err:
+            if committed:
+                self.discardAdded(ids)
+            for *_, future in requests:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for *_, future in accepted:
+            future.set_result(None)
+
+    def discardAdded(self, ids: np.ndarray):
+        """
+        id 表与日志已提交但索引写入失败时，删除这些 id 并记为墓碑；日志中的新增在重放时
+        因 id 表中没有对应的人脸而同样记为墓碑
+        """
+        try:
+            self.sqlite.executemany("DELETE FROM ids WHERE id = ?", [(int(id),) for id in ids])
+        except Exception as err:
+            logger.error(f"removing face ids of a failed add failed with error: {str(err)}")
+        with self.rwlock.write():  # 索引可能已写入了一部分
+            self.tombstones.update(int(id) for id in ids)
+            self.updateSelector()
+
+    def updateSelector(self):
+        """
+        墓碑变化后重建跳过已删除 id 的 IDSelector，由持有写入锁的线程在写锁内调用
+        """
+        self._selector = self.buildSelector(self.tombstones)
+
+    @staticmethod
+    def buildSelector(tombstones: set[int]):
+        """
+        跳过 tombstones 的 IDSelector，没有墓碑时为 None
+        """
+        if not tombstones:
+            return None
+        deleted = np.fromiter(tombstones, dtype=np.int64, count=len(tombstones))
+        batch = faiss.IDSelectorBatch(len(deleted), faiss.swig_ptr(deleted))
+        # SWIG 对象只保存指针，需要持有 Python 引用
+        return (faiss.IDSelectorNot(batch), batch, deleted)
+
+    def searchParameters(self, index):
+        """
+        有墓碑时返回 index 上跳过已删除 id 的搜索参数，否则返回 None
+        IndexIDMap2.search 会在调用期间改写 params->sel，并发检索不能共用同一个
+        参数对象，因此每次检索新建参数，只复用 IDSelector
+        """
+        selector = self._selector
+        if selector is None:
+            return None
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector[0], efSearch=inner.hnsw.efSearch)
+        if isinstance(inner, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(sel=selector[0], nprobe=inner.nprobe)
+        return faiss.SearchParameters(sel=selector[0])
+
+    def search(self, query_vectors, k: int):
+        """
+        Faiss 搜索，跳过已删除的 id
+        """
+        with self.rwlock.read():
+            return self._search(query_vectors, k)
+
+    def _search(self, query_vectors, k: int):
+        start = time.perf_counter()
+        indexes = [self.faiss] if not self.snapshot_hidden else []
+        if self.delta is not None:
+            indexes.append(self.delta)
+        results = [
+            index.search(query_vectors, k, params=self.searchParameters(index))
+            for index in indexes
+            if index.ntotal
+        ]
+        if len(results) == 1:
+            distances, indices = results[0]
+        elif not results:
+            distances = np.full((len(query_vectors), k), -np.inf, dtype=np.float32)
+            indices = np.full((len(query_vectors), k), -1, dtype=np.int64)
+        else:  # 合并快照与新增索引的结果
+            distances = np.concatenate([distances for distances, _ in results], axis=1)
+            indices = np.concatenate([indices for _, indices in results], axis=1)
+            order = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+            distances = np.take_along_axis(distances, order, axis=1)
+            indices = np.take_along_axis(indices, order, axis=1)
+        metrics.SEARCH_SECONDS.observe(time.perf_counter() - start)
+        return distances, indices
+
     def searchSimilarFaces(self, query_vector, threshold) -> tuple | None:
         """
         查询相似的人脸向量
@@ -57,18 +288,80 @@ class FaceDatabase:
         Returns:
         tuple or None: 返回超过阈值的最相似人脸向量的id和对应的距离，如果没有超过阈值的，则返回 None
         """
-        distances, indices = self.faiss.search(
-            query_vector, 1
-        )  # 使用 Faiss 进行搜索
-        if distances[0][0] > threshold:
-            name = self.query_database(
-                "SELECT name FROM ids WHERE id = ?", (int(indices[0][0]),)
-            )
-            if name is None:
+        return self.searchSimilarFacesBatch(query_vector[:1], threshold)[0]
+
+    def searchSimilarFacesBatch(self, query_vectors, threshold) -> list:
+        """
+        批量查询相似的人脸向量，只调用一次 Faiss 搜索
+        Parameters:
+        query_vectors: (N, dimension) 的查询向量
+        threshold: 相似度阈值
+        Returns:
+        list: 每个查询向量对应 (name, distance) 或 None
+        """
+        return [
+            matches[0] if matches else None
+            for matches in self.searchTopK(query_vectors, 1, threshold)
+        ]
+
+    def searchTopK(self, query_vectors, k: int, threshold=None, aggregate: str | None = None) -> list:
+        """
+        批量 top-k 检索，N 个查询向量只调用一次 Faiss 搜索
+        Parameters:
+        query_vectors: (N, dimension) 的查询向量
+        k: 每个查询返回的结果数量
+        threshold: 相似度阈值，只返回大于阈值的结果
+        aggregate: None 时逐张入库图像返回；"max" / "mean" 时将同一身份的多张
+            入库图像合并，按最大 / 平均相似度打分
+        Returns:
+        list: 每个查询向量对应一个按相似度降序的列表，元素为 (name, distance)，
+            聚合时为 (identity, score, 命中图像数)
+        """
+        if aggregate not in (None, "max", "mean"):
+            raise ValueError("not a correct aggregate method", aggregate)
+        with self.rwlock.read():  # 检索与 id 映射在同一次读锁内完成
+            count = len(self)
+            if count == 0 or k <= 0:
+                return [[] for _ in range(len(query_vectors))]
+            search_k = k if aggregate is None else k * self.search_oversample
+            distances, indices = self._search(query_vectors, min(search_k, count))
+            results = []
+            for row_distances, row_indices in zip(distances, indices):
+                valid = row_indices >= 0
+                hits = list(zip(row_indices[valid].tolist(), row_distances[valid].tolist()))
+                if aggregate is None:
+                    matches = [(self.nameOf(id), distance) for id, distance in hits]
+                else:
+                    matches = self.aggregateHits(hits, aggregate)
+                if threshold is not None:
+                    matches = [match for match in matches if match[1] > threshold]
+                results.append(matches[:k])
+        return results
+
+    def aggregateHits(self, hits: list, aggregate: str) -> list:
+        """
+        将 (id, distance) 命中按身份合并，返回按得分降序的 (identity, score, count)
+        """
+        groups: dict[str, list[float]] = {}
+        for id, distance in hits:
+            identity = self.id_to_identity.get(id)
+            if identity is None:
                 raise ValueError("Find face but can't find name in database")
-            return name[0], float(distances[0][0])  # 返回人脸 id 和距离
-        else:
-            return None  # 如果没有超过阈值的则返回 None
+            groups.setdefault(identity, []).append(distance)
+        scored = []
+        for identity, distances in groups.items():
+            score = max(distances) if aggregate == "max" else sum(distances) / len(distances)
+            scored.append((identity, score, len(distances)))
+        return sorted(scored, key=lambda item: item[1], reverse=True)
+
+    def nameOf(self, id: int) -> str:
+        """
+        Faiss id 对应的人脸名
+        """
+        name = self.id_to_name.get(id)
+        if name is None:
+            raise ValueError("Find face but can't find name in database")
+        return name
 
     def removeFaceById(self, face_id: str):
         """
@@ -76,11 +369,176 @@ class FaceDatabase:
         Parameters:
         face_id: 待删除的人脸 id
         """
-        id = self.query_database("SELECT id FROM ids WHERE name = ?", (face_id,))
-        self.faiss.remove_ids(np.array([id[0]]))  # 从 Faiss 索引中删除人脸向量
-        self.query_database(
-            "DELETE FROM ids WHERE id = ?", (int(id[0]),)
-        )  # 删除人脸 id 表中的人脸 id
+        self.removeFacesByIds([face_id])
+
+    def removeFacesByIds(self, face_ids: list):
+        """
+        批量删除人脸向量，id 表在一个事务内删除
+        向量只记为墓碑并在搜索时跳过，墓碑数量达到阈值后压缩索引
+        Parameters:
+        face_ids: 待删除的人脸 id 列表
+        """
+        names = set(str(face_id) for face_id in face_ids)
+        with self.lock:
+            self.checkWritable()
+            if not names.issubset(self.name_to_id):
+                raise ValueError("Face id not found in database")
+            ids = [self.name_to_id[name] for name in names]
+            self.sqlite.executemany(
+                "DELETE FROM ids WHERE id = ?", [(id,) for id in ids]
+            )  # 删除人脸 id 表中的人脸 id
+            self.oplog.append_remove(ids)
+            with self.rwlock.write():
+                for name, id in zip(names, ids):
+                    del self.id_to_name[id], self.name_to_id[name], self.id_to_identity[id]
+                self.tombstones.update(ids)
+                self.updateSelector()
+        self.requestSnapshot()
+        self.requestMaintenance()
+
+    def compactDatabase(self):
+        """
+        去掉所有墓碑 id 对应的向量，索引类型不变
+        Flat / SQ / PQ / IVF 索引直接在原索引上 remove_ids，不重建、不重新训练，也不需要
+        整个库的 float32 副本；HNSW 等不支持删除的索引才重建
+        """
+        if not self.tombstones:
+            return
+        if not self.supportsRemove():
+            self.rebuildIndex()
+            return
+        with self.lock:
+            self.ensureWritable()
+            removed = np.fromiter(self.tombstones, dtype=np.int64, count=len(self.tombstones))
+            with self.rwlock.write():
+                self.faiss.remove_ids(faiss.IDSelectorBatch(len(removed), faiss.swig_ptr(removed)))
+                self.index_version += 1  # 向量位置已变，进行中的后台重建不能再按位置补入新增
+                self.rebuilt = True  # 删除已在日志中，但压缩后的索引需要写入快照
+                self.tombstones = set()
+                self.updateSelector()
+
+    def supportsRemove(self) -> bool:
+        """
+        当前索引能否直接删除向量
+        """
+        inner = faiss.downcast_index(self.faiss.index)
+        return isinstance(inner, (faiss.IndexFlatCodes, faiss.IndexIVF))
+
+    def rebuildIndex(self, factory: str | None = None):
+        """
+        将现有向量重建为 factory 类型的索引并去掉墓碑，需要训练时只在采样上训练一次
+        训练与构建不持有写入锁，期间的新增在切换前补入新索引，删除记为墓碑；
+        期间索引被清空或替换时放弃本次重建
+        PQ/SQ 索引重建出的是量化后的近似向量
+        Parameters:
+        factory: Faiss factory 字符串，默认沿用当前索引类型
+        Returns:
+        bool: 是否切换到了重建的索引
+        """
+        with self._rebuild_lock:
+            with self.lock:
+                self.checkWritable()
+                version, source, count = self.index_version, self.faiss, self.faiss.ntotal
+                ids = faiss.vector_to_array(source.id_map)
+                vectors = source.index.reconstruct_n(0, count)
+                removed = set(self.tombstones)
+            if removed:
+                alive = ~np.isin(ids, np.fromiter(removed, dtype=np.int64, count=len(removed)))
+                vectors, ids = vectors[alive], ids[alive]
+            factory = factory or self.factory or self.resolveFactory(len(ids))
+            index = build_index(
+                vectors,
+                ids,
+                self.dimension,
+                factory,
+                self.index_params,
+                self.ef_construction,
+                self.train_sample,
+            )  # 在新索引上构建，检索与写入照常使用旧索引
+            with self.lock:
+                if self.index_version != version:
+                    logger.warning("faiss index changed during the rebuild, discarding it")
+                    return False
+                if source.ntotal > count:  # 构建期间的新增
+                    index.add_with_ids(
+                        source.index.reconstruct_n(count, source.ntotal - count),
+                        faiss.vector_to_array(source.id_map)[count:],
+                    )
+                self.setIndexFactory(factory)
+                with self.rwlock.write():
+                    self.faiss = index
+                    self.index_version += 1
+                    self.mmapped = False
+                    self.rebuilt = True
+                    self.tombstones = self.tombstones - removed  # 构建期间的删除
+                    self.updateSelector()
+            return True
+
+    def targetFactory(self) -> str | None:
+        """
+        库容量跨过档位或已攒够训练样本时应切换到的 factory，不需要切换时返回 None
+        降档要求容量低于档位阈值的 0.8 倍，避免在阈值附近增删时反复重建
+        """
+        if self.pinned or not (self.index_factory == AUTO or self.factory == "Flat"):
+            return None
+        count = len(self)
+        factory = self.resolveFactory(count)
+        if factory == self.factory or self.resolveFactory(int(count / 0.8)) == self.factory:
+            return None
+        return factory
+
+    def needsMaintenance(self) -> bool:
+        """
+        是否需要切换索引类型或压缩墓碑
+        """
+        return len(self.tombstones) >= self.compact_tombstones or self.targetFactory() is not None
+
+    def maintainIndex(self):
+        """
+        按需重建索引：库容量跨过档位时切换索引类型，墓碑达到 compact_tombstones 时压缩
+        """
+        factory = self.targetFactory()
+        if factory is not None:
+            logger.info(f"rebuilding faiss index {self.factory} -> {factory}")
+        elif len(self.tombstones) < self.compact_tombstones:
+            return
+        try:
+            if factory is None:
+                self.compactDatabase()
+            else:
+                self.rebuildIndex(factory)
+        except Exception as err:  # 写入已经生效，重建失败时继续使用当前索引
+            logger.error(f"rebuild faiss index failed with error: {str(err)}")
+
+    def requestMaintenance(self):
+        """
+        需要重建时交给后台快照线程，不阻塞写入请求；没有后台线程(离线录入)时直接重建
+        """
+        if self.read_only or not self.needsMaintenance():
+            return
+        if self._snapshot_thread is not None:
+            self._snapshot_wakeup.set()
+        else:
+            self.maintainIndex()
+
+    def pinIndexFactory(self, pinned: bool):
+        """
+        固定当前索引类型(migrate-index 指定了 factory)，不再按库容量自动切换
+        """
+        self.pinned = pinned
+        self.sqlite.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('index_factory_pinned', ?)",
+            ("1" if pinned else "0",),
+        )
+
+    def setIndexFactory(self, factory: str):
+        """
+        记录当前索引的 factory 字符串
+        """
+        self.factory = factory
+        self.sqlite.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('index_factory', ?)", (factory,)
+        )
 
     def __len__(self):
         """
@@ -88,25 +546,328 @@ class FaceDatabase:
         Returns:
         int: 人脸向量数量
         """
-        return self.faiss.ntotal  # 返回保存的人脸向量数量
+        count = 0 if self.snapshot_hidden else self.faiss.ntotal
+        if self.delta is not None:
+            count += self.delta.ntotal
+        return count - len(self.tombstones)  # 返回保存的人脸向量数量
 
     def clearDatabase(self):
         """
         清空数据库，删除所有的人脸向量
         """
-        self.faiss.reset()  # 重置 Faiss 索引
+        with self.lock:
+            self.ensureWritable()
+            self.oplog.append_clear()
+            with self.rwlock.write():
+                self.faiss.reset()  # 重置 Faiss 索引
+                self.index_version += 1
+                self.tombstones = set()
+                self.updateSelector()
 
     def saveDatabase(self):
         """
-        保存数据库到指定路径
+        保存快照到指定路径：在锁内复制索引并封存当前日志段，锁外序列化写入临时文件后
+        原子替换，成功后删除快照已包含的日志段。复制只是内存拷贝，写入线程不必等待
+        序列化与磁盘写入
         """
-        faiss.write_index(self.faiss, self.faiss_path.as_posix())
+        if self.read_only:
+            return
+        with self._snapshot_lock:
+            with self.lock:
+                if self.mmapped and not self.oplog.has_records() and not self.rebuilt:
+                    return  # 映射的就是磁盘上的快照，且此后没有写入
+                # 删除只写日志与 id 表，不会换出映射的索引；此时同样复制映射的索引写入快照，
+                # 墓碑已在 id 表中，只读副本随新快照重新加载映射
+                index = faiss.clone_index(self.faiss)
+                self.rebuilt = False
+                sealed = self.oplog.rotate()
+            self.faiss_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.faiss_path.with_name(self.faiss_path.name + ".tmp")
+            faiss.write_index(index, tmp_path.as_posix())
+            del index
+            with open(tmp_path, "rb+") as file:
+                os.fsync(file.fileno())
+            os.replace(tmp_path, self.faiss_path)
+            self.oplog.discard(sealed)
+            self._snapshot_mtime = self.faiss_path.stat().st_mtime_ns
+
+    def requestSnapshot(self):
+        """
+        日志记录数达到 snapshot_ops 时唤醒后台快照线程
+        """
+        if self._snapshot_thread is not None and self.oplog.pending >= self.snapshot_ops:
+            self._snapshot_wakeup.set()
+
+    def startSnapshots(self):
+        """
+        启动后台快照线程，每 snapshot_interval 秒或日志达到 snapshot_ops 条时写入快照
+        """
+        if self._snapshot_thread is None:
+            self._snapshot_stop.clear()
+            self._snapshot_thread = threading.Thread(
+                target=self._snapshotLoop, name="faiss-snapshot", daemon=True
+            )
+            self._snapshot_thread.start()
+
+    def stopSnapshots(self):
+        """
+        停止后台快照线程
+        """
+        if self._snapshot_thread is not None:
+            self._snapshot_stop.set()
+            self._snapshot_wakeup.set()
+            self._snapshot_thread.join()
+            self._snapshot_thread = None
+
+    def _snapshotLoop(self):
+        while not self._snapshot_stop.is_set():
+            self._snapshot_wakeup.wait(self.snapshot_interval)
+            self._snapshot_wakeup.clear()
+            if self._snapshot_stop.is_set():
+                continue
+            try:
+                if self.read_only:
+                    if self.snapshotChanged():  # 写入进程写入了新快照，只读副本跟随切换
+                        self.reloadDatabase()
+                    continue
+                if self.needsMaintenance():  # 切换索引类型、压缩墓碑都在后台线程中进行
+                    self.maintainIndex()
+                if self.oplog.pending or self.rebuilt:
+                    self.saveDatabase()
+                elif self.index_mmap and not self.mmapped:
+                    # 上一次快照之后的整个间隔内没有写入，换回只读映射；持续写入时保持私有索引，
+                    # 避免每次快照后的第一次写入都要重新载入索引
+                    self.remapDatabase()
+            except Exception as err:
+                logger.error(f"faiss snapshot failed with error: {str(err)}")
+
+    def snapshotChanged(self) -> bool:
+        """
+        磁盘上的快照是否已被替换
+        """
+        try:
+            return self.faiss_path.stat().st_mtime_ns != self._snapshot_mtime
+        except FileNotFoundError:
+            return False
+
+    def readLog(self, index) -> tuple[dict, bool]:
+        """
+        读取快照之后的增删日志，返回 (index 中不存在的新增 id -> 向量, 日志中是否有清空)
+        只读副本不截断写入进程可能正在追加的日志
+        """
+        existing = set(faiss.vector_to_array(index.id_map).tolist())
+        added: dict[int, np.ndarray] = {}
+        cleared = False
+        for op, id, vector in self.oplog.replay(truncate=not self.read_only):
+            if op == OP_ADD:
+                added[id] = vector
+            elif op == OP_REMOVE:
+                added.pop(id, None)  # 快照中的向量由 loadIdMap 记为墓碑
+            elif op == OP_CLEAR:
+                added.clear()
+                existing.clear()
+                cleared = True
+        return {id: vector for id, vector in added.items() if id not in existing}, cleared
+
+    def replayLog(self, index):
+        """
+        将快照之后的增删日志重放到可写的 index 上；已在快照中的 id 会被跳过
+        """
+        added, cleared = self.readLog(index)
+        if cleared:
+            index.reset()
+        if added:
+            logger.info(f"replaying {len(added)} faces from {self.oplog.path}")
+            index.add_with_ids(
+                np.stack(list(added.values())), np.fromiter(added, dtype=np.int64, count=len(added))
+            )
+
+    def readDelta(self, index) -> tuple:
+        """
+        只读副本不修改映射的快照，快照之后的新增放入单独的 Flat 索引
+        Returns:
+        tuple: (新增索引或 None, 快照是否已被日志中的清空覆盖)
+        """
+        added, cleared = self.readLog(index)
+        if not added:
+            return None, cleared
+        delta = self.createIndex("Flat")
+        delta.add_with_ids(
+            np.stack(list(added.values())), np.fromiter(added, dtype=np.int64, count=len(added))
+        )
+        return delta, cleared
+
+    def readIndex(self, mmap: bool):
+        """
+        读取快照文件；mmap 时以只读方式映射，支持的索引类型(IVF 倒排表、Flat 编码)
+        不再复制到进程私有内存，其余类型照常读入
+        """
+        flags = 0
+        if mmap:
+            flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+            flags |= getattr(faiss, "IO_FLAG_MMAP_IFC", 0)  # 较新的 Faiss 支持映射 Flat 编码
+        self._snapshot_mtime = self.faiss_path.stat().st_mtime_ns
+        index = faiss.read_index(self.faiss_path.as_posix(), flags)
+        if self.index_params:
+            faiss.ParameterSpace().set_index_parameters(index, self.index_params)
+        return index
+
+    def checkWritable(self):
+        """
+        只读副本拒绝写入
+        """
+        if self.read_only:
+            raise ValueError("face database is a read-only replica")
+
+    def ensureWritable(self):
+        """
+        只读映射的索引在第一次写入前载入私有内存，并重放日志
+        """
+        self.checkWritable()
+        with self.lock:
+            if self.mmapped:
+                logger.info("loading the memory-mapped faiss index for writing")
+                index = self.readIndex(False)
+                self.replayLog(index)
+                with self.rwlock.write():
+                    self.faiss = index
+                    self.index_version += 1
+                    self.mmapped = False
+
+    def remapDatabase(self):
+        """
+        写入进程换回快照的只读映射，释放私有内存中的索引
+        映射期间有新的写入时放弃切换，继续使用私有索引
+        """
+        with self._snapshot_lock:
+            if self.oplog.has_records() or self.rebuilt:
+                return
+            index = self.readIndex(True)  # 在锁外读取，不阻塞写入
+            with self.lock:
+                if self.oplog.has_records() or self.rebuilt:
+                    return
+                with self.rwlock.write():  # 快照与内存中的索引内容相同，id 映射与墓碑不变
+                    self.faiss, self.mmapped = index, True
+                    self.index_version += 1
+        logger.info("switched the faiss index back to the memory-mapped snapshot")
+
+    def reloadDatabase(self):
+        """
+        热切换到磁盘上的最新快照并重放日志，无需重启服务
+        只读副本总是以只读映射加载快照，日志中的新增放入单独的索引；读取期间写入进程
+        追加或封存的日志会在下一次快照更新后被读到
+        写入进程在 mmap 模式下日志为空时以只读映射加载，否则载入私有内存并重放日志
+        """
+        if self.read_only:
+            index = self.readIndex(True)
+            delta, hidden = self.readDelta(index)
+            id_map = self.readIdMap(index, delta, hidden, remove_orphans=False)
+            with self.lock:
+                with self.rwlock.write():
+                    self.faiss, self.delta, self.snapshot_hidden = index, delta, hidden
+                    self.index_version += 1
+                    self.mmapped = True
+                    self.setIdMap(id_map)
+        else:
+            with self.lock:  # 日志只在写入锁内追加，持有写入锁读取快照与日志不会错过记录
+                mmapped = self.index_mmap and not self.oplog.has_records() and not self.rebuilt
+                index = self.readIndex(mmapped)
+                if not mmapped:
+                    pending = self.oplog.pending
+                    self.replayLog(index)
+                    self.oplog.pending = pending  # 重放的记录已在日志中，不需要再触发快照
+                # id 表只在写入锁内修改，在写锁外读取即可，检索只在切换时短暂等待
+                id_map = self.readIdMap(index, remove_orphans=False)
+                with self.rwlock.write():
+                    self.faiss, self.mmapped, self.rebuilt = index, mmapped, False
+                    self.index_version += 1
+                    self.setIdMap(id_map)
+        logger.info(f"reloaded faiss index with {len(self)} faces (mmap: {self.mmapped})")
 
     def loadDatabase(self):
         """
-        从指定路径加载数据库
+        从指定路径加载数据库，旧版按位置编号的索引会迁移为 IndexIDMap2
         """
-        self.faiss = faiss.read_index(self.faiss_path.as_posix())
+        # 只读副本总是映射快照；写入进程有未写入快照的日志时需要在私有内存中重放
+        self.mmapped = self.read_only or (self.index_mmap and not self.oplog.has_records())
+        index = self.readIndex(self.mmapped)
+        row = self.sqlite.fetchone("SELECT value FROM meta WHERE key = 'index_factory'")
+        self.factory = row[0] if row else None  # 旧版索引类型未记录
+        if not isinstance(index, faiss.IndexIDMap2):
+            self.mmapped = False
+            vectors = index.reconstruct_n(0, index.ntotal)
+            self.setIndexFactory(self.resolveFactory(len(vectors)))
+            index = build_index(
+                vectors,
+                np.arange(len(vectors), dtype=np.int64),
+                self.dimension,
+                self.factory,
+                self.index_params,
+                self.ef_construction,
+                self.train_sample,
+            )
+        self.faiss = index
+
+    @staticmethod
+    def indexedIds(index, delta=None, hidden: bool = False) -> set[int]:
+        """
+        检索时可见的全部 Faiss id，包括墓碑
+        Parameters:
+        index: 快照或私有索引
+        delta: 只读副本中快照之后新增的索引
+        hidden: 快照中的向量是否全部不可见
+        """
+        indexed = set()
+        if not hidden:
+            indexed.update(faiss.vector_to_array(index.id_map).tolist())
+        if delta is not None:
+            indexed.update(faiss.vector_to_array(delta.id_map).tolist())
+        return indexed
+
+    def readIdMap(self, index, delta=None, hidden: bool = False, remove_orphans: bool = True) -> tuple:
+        """
+        读取 id 表构建 id <-> 人脸名映射与墓碑，不修改当前状态，可以在写锁外调用
+        Faiss 索引中存在但 id 表中已删除的 id 记为墓碑
+        Parameters:
+        index, delta, hidden: 映射将对应的索引，见 indexedIds
+        remove_orphans: 是否删除没有向量的 id；热切换时其他进程可能刚写入 id 表，不删除
+        Returns:
+        tuple: (id_to_name, name_to_id, id_to_identity, tombstones, selector)，交给 setIdMap
+        """
+        rows = self.sqlite.fetchall("SELECT id, name, COALESCE(identity, name) FROM ids")
+        indexed = self.indexedIds(index, delta, hidden)
+        orphans = [id for id, _, _ in rows if id not in indexed]
+        if orphans and remove_orphans:  # 写入 id 表后、写入日志前崩溃的人脸没有向量，删除后可重新录入
+            logger.warning(f"removing {len(orphans)} face ids without an embedding")
+            self.sqlite.executemany("DELETE FROM ids WHERE id = ?", [(id,) for id in orphans])
+            rows = [row for row in rows if row[0] in indexed]
+        id_to_name = {id: name for id, name, _ in rows}
+        name_to_id = {name: id for id, name, _ in rows}
+        id_to_identity = {id: identity for id, _, identity in rows}
+        tombstones = indexed.difference(id_to_name)
+        return id_to_name, name_to_id, id_to_identity, tombstones, self.buildSelector(tombstones)
+
+    def setIdMap(self, id_map: tuple):
+        """
+        切换到 readIdMap 构建的映射，切换时应持有写锁
+        """
+        (
+            self.id_to_name,
+            self.name_to_id,
+            self.id_to_identity,
+            self.tombstones,
+            self._selector,
+        ) = id_map
+
+    def loadIdMap(self, remove_orphans: bool = True):
+        """
+        从 id 表加载内存中的 id <-> 人脸名映射，检索时不再访问 SQLite
+        Parameters:
+        remove_orphans: 是否删除没有向量的 id，见 readIdMap
+        """
+        self.setIdMap(
+            self.readIdMap(self.faiss, self.delta, self.snapshot_hidden, remove_orphans)
+        )
 
     def query_database(self, sql: str, query: tuple):
         """访问数据库
@@ -118,9 +879,12 @@ class FaceDatabase:
         Returns:
            result: 访问结果(Nonable)
         """
-        with sqlite3.connect(self.index_path, check_same_thread=False) as conn:
-            cursor = conn.cursor()
-            cursor.execute(sql, query)
-            result = cursor.fetchone()
-            conn.commit()
-        return result
+        if sql.lstrip().upper().startswith("SELECT"):
+            return self.sqlite.fetchone(sql, query)
+        return self.sqlite.execute(sql, query).fetchone()
+
+    def close(self):
+        """关闭 id 表的连接与日志"""
+        self.stopSnapshots()
+        self.oplog.close()
+        self.sqlite.close()
@@ -1,8 +1,20 @@
-from multiprocessing import Pool, set_start_method
-import signal
+import asyncio
+import queue
+import time
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
 from face_hnfnu.AdaFaceFeature import AdaFaceFeature
 from face_hnfnu.FaceDatabase import FaceDatabase
+from face_hnfnu.batching import BatchScheduler
+from face_hnfnu.embedding_cache import EmbeddingCache
+from face_hnfnu.executor import InferenceExecutor, ServerBusyError
+from face_hnfnu.tracking import FaceTracker
 from face_hnfnu.Config import server_config
+from face_hnfnu import worker
+
+SHM_BLOCK_SIZE = server_config.ALIGN_MAX_SIZE ** 2 * 3  # 缩放后 BGR 图像的最大字节数
 
 
 class ProcPool:
@@ -10,12 +22,11 @@ class ProcPool:
         """
         Called when server is starting up. Initializes the multiprocessing pool.
         """
-        set_start_method("spawn")
-        self.pool = Pool(
+        self.pool = get_context("spawn").Pool(
             processes=server_config.THREAD_COUNT,
-            initializer=signal.signal,
-            initargs=(signal.SIGINT, signal.SIG_IGN),  # ignore sigint signal
+            initializer=worker.init_worker,
         )
+        self.shm_blocks: queue.SimpleQueue = queue.SimpleQueue()  # 可复用的共享内存块
 
     def shutdown_event(self):
         """
@@ -23,29 +34,364 @@ class ProcPool:
         """
         self.pool.terminate()
         self.pool.join()
+        while not self.shm_blocks.empty():
+            shm = self.shm_blocks.get_nowait()
+            shm.close()
+            shm.unlink()
+
+    def submit_represent(self, np_image: np.ndarray, multi_face: bool = False) -> Future:
+        """
+        将图像写入共享内存，交给工作进程检测、对齐并推理，不等待结果，
+        多张图像可同时在各工作进程中处理；共享内存块在任务完成的回调中归还
+        """
+        nbytes = np_image.nbytes
+        if nbytes <= SHM_BLOCK_SIZE:
+            try:
+                shm = self.shm_blocks.get_nowait()
+            except queue.Empty:
+                shm = SharedMemory(create=True, size=SHM_BLOCK_SIZE)
+        else:
+            shm = SharedMemory(create=True, size=nbytes)
+        future: Future = Future()
+
+        def release():
+            if shm.size == SHM_BLOCK_SIZE:
+                self.shm_blocks.put(shm)
+            else:
+                shm.close()
+                shm.unlink()
+
+        def done(result):
+            release()
+            future.set_result(result)
+
+        def failed(err: BaseException):
+            release()
+            future.set_exception(err)
+
+        try:
+            shared = np.ndarray(np_image.shape, dtype=np_image.dtype, buffer=shm.buf)
+            shared[...] = np_image
+            del shared
+            self.pool.apply_async(
+                worker.represent_shared,
+                (shm.name, np_image.shape, np_image.dtype.str, multi_face),
+                callback=done,
+                error_callback=failed,
+            )
+        except BaseException:
+            release()
+            raise
+        return future
+
+    def submit_crops(self, aligned_bgr_imgs: np.ndarray) -> Future:
+        """对已对齐的 (N, 112, 112, 3) 人脸推理，人脸较小，直接随任务传入"""
+        future: Future = Future()
+        self.pool.apply_async(
+            worker.represent_crops,
+            (aligned_bgr_imgs,),
+            callback=future.set_result,
+            error_callback=future.set_exception,
+        )
+        return future
 
 
 class AdafaceServer:
     ada_face_feature: AdaFaceFeature
     face_database: FaceDatabase
+    executor: InferenceExecutor
+    batch_scheduler: BatchScheduler | None = None
+    embedding_cache: EmbeddingCache | None = None
 
     def startup_event(self):
         self.ada_face_feature = AdaFaceFeature(config=server_config)
+        if server_config.EMBEDDING_CACHE_BYTES > 0:
+            self.embedding_cache = EmbeddingCache(
+                server_config.EMBEDDING_CACHE_BYTES, server_config.EMBEDDING_CACHE_TTL
+            )
         self.face_database = FaceDatabase(config=server_config)
-        self.ada_face_feature.load_pretrained_model()
+        self.face_database.startSnapshots()
+        if server_config.INFERENCE_MODE != "process":
+            # 进程池模式下由各工作进程加载模型，父进程只负责解码与检索
+            self.ada_face_feature.load_pretrained_model()
+            self.batch_scheduler = BatchScheduler(
+                self.ada_face_feature.batch_get_represent,
+                max_batch_size=server_config.BATCH_MAX_SIZE,
+                max_wait_ms=server_config.BATCH_MAX_WAIT_MS,
+            ).start()
+        self.executor = InferenceExecutor(
+            max_workers=server_config.THREAD_COUNT,
+            queue_size=server_config.INFERENCE_QUEUE_SIZE,
+        )
 
     def shutdown_event(self):
+        self.executor.shutdown()
+        if self.batch_scheduler is not None:
+            self.batch_scheduler.stop()
+        self.face_database.stopSnapshots()
         self.face_database.saveDatabase()
+        self.face_database.close()
 
-    def verify_face(self, img, threshold) -> tuple:
+    def prepare_represent(self, data, multi_face: bool = False) -> tuple:
+        """
+        在推理线程中完成缓存查找、解码、检测与对齐，提交推理后立即返回，不等待结果
+        单人脸模式的结果为 (1, 512) 的特征向量；多人脸模式为 (confs, bboxes, features)
+        Returns:
+        tuple: (缓存 key 或 None, 缓存命中的结果或批处理调度器 / 进程池的 Future)
+        """
+        key = None
+        if self.embedding_cache is not None and not isinstance(data, np.ndarray):  # 原始像素帧不缓存
+            key = self.embedding_cache.key(data, "multi" if multi_face else "single")
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return None, cached
         try:
-            result = self.face_database.searchSimilarFaces(
-                self.ada_face_feature.byte_get_represent(img).detach().numpy(), threshold
+            np_image = self.ada_face_feature.decode(data)
+            if server_config.INFERENCE_MODE == "process":
+                return key, procpool.submit_represent(np_image, multi_face)
+            if not multi_face:
+                aligned_bgr_img = self.ada_face_feature.detect_and_align(np_image)
+                return key, self.batch_scheduler.submit(aligned_bgr_img)
+            confs, bboxes, landmarks = self.ada_face_feature.detect_faces(np_image)
+            aligned_bgr_imgs = self.ada_face_feature.align_faces(np_image, bboxes, landmarks)
+        except Exception as err:
+            raise ValueError(f"无法提取脸部特征向量, caused by:{err}") from err
+        future: Future = Future()
+
+        def done(features: Future):
+            if features.cancelled():  # 批处理调度器停止
+                future.cancel()
+            elif features.exception() is not None:
+                future.set_exception(features.exception())
+            else:
+                future.set_result((confs, bboxes, features.result()))
+
+        self.batch_scheduler.submit_many(aligned_bgr_imgs).add_done_callback(done)
+        return key, future
+
+    def store(self, key, result):
+        """将 prepare_represent 得到的结果写入缓存"""
+        if key is not None:
+            self.embedding_cache.put(key, result)
+        return result
+
+    def get_represent(self, data):
+        """检测对齐人脸后交给批处理调度器推理，在当前线程等待 (1, 512) 的特征向量"""
+        key, result = self.prepare_represent(data)
+        if isinstance(result, Future):
+            try:
+                result = result.result()
+            except Exception as err:
+                raise ValueError(f"无法提取脸部特征向量, caused by:{err}") from err
+        return self.store(key, result)
+
+    async def represent_async(self, data, multi_face: bool = False):
+        """
+        在事件循环中等待推理：推理线程只执行 prepare_represent，等待批次期间不占用线程，
+        并发请求才能凑满 batch_max_size 个人脸
+        """
+        key, result = await self.executor.run(self.prepare_represent, data, multi_face)
+        if isinstance(result, Future):
+            try:
+                result = await asyncio.wrap_future(result)
+            except Exception as err:
+                raise ValueError(f"无法提取脸部特征向量, caused by:{err}") from err
+        return self.store(key, result)
+
+    def get_represent_many(self, datas: list) -> list:
+        """
+        提取多张图像中最主要人脸的特征，全部提交后再等待结果，使其合并进同一批次推理
+        Returns:
+        list: 每张图像对应 (1, 512) 的特征向量，失败时为 ValueError
+        """
+        cache = self.embedding_cache
+        if cache is not None:
+            keys = [None if isinstance(data, np.ndarray) else cache.key(data, "single") for data in datas]
+        else:
+            keys = [None] * len(datas)
+        pending, hits = [], set()
+        for i, data in enumerate(datas):
+            try:
+                cached = cache.get(keys[i]) if keys[i] is not None else None
+                if cached is not None:
+                    pending.append(cached)
+                    hits.add(i)
+                    continue
+                np_image = self.ada_face_feature.decode(data)
+                if server_config.INFERENCE_MODE == "process":  # 各图像同时在工作进程中处理
+                    pending.append(procpool.submit_represent(np_image))
+                    continue
+                aligned_bgr_img = self.ada_face_feature.detect_and_align(np_image)
+                pending.append(self.batch_scheduler.submit(aligned_bgr_img))
+            except Exception as err:
+                pending.append(ValueError(f"无法提取脸部特征向量, caused by:{err}"))
+        features = []
+        for i, item in enumerate(pending):
+            if isinstance(item, Future):
+                try:
+                    item = item.result()
+                except Exception as err:
+                    item = ValueError(f"无法提取脸部特征向量, caused by:{err}")
+            if keys[i] is not None and i not in hits and not isinstance(item, Exception):
+                cache.put(keys[i], item)
+            features.append(item)
+        return features
+
+    def verify_batch(self, datas: list, k: int, threshold, aggregate: str | None = None) -> list:
+        """
+        识别多张图像(例如连续的视频帧)，一次 Faiss 检索返回每张图像的 top-k
+        aggregate 为 "max" / "mean" 时按身份聚合同一人的多张入库图像
+        """
+        features = self.get_represent_many(datas)
+        found = [feature for feature in features if not isinstance(feature, Exception)]
+        matches = iter(
+            self.face_database.searchTopK(np.concatenate(found), k, threshold, aggregate)
+            if found
+            else []
+        )
+        keys = ("face_id", "distance") if aggregate is None else ("identity", "score", "count")
+        return [
+            {"result": "False", "error": str(feature)}
+            if isinstance(feature, Exception)
+            else {"result": "True", "matches": [dict(zip(keys, match)) for match in next(matches)]}
+            for feature in features
+        ]
+
+    def match_faces(self, confs, bboxes, features, threshold) -> list:
+        """一次批量检索图像中的所有人脸"""
+        results = self.face_database.searchSimilarFacesBatch(features, threshold)
+        return [
+            {
+                "bbox": [int(v) for v in bbox],
+                "confidence": float(conf),
+                "most_similar_face": None if result is None else result[0],
+                "distance": None if result is None else result[1],
+            }
+            for conf, bbox, result in zip(confs, bboxes, results)
+        ]
+
+    async def verify_faces(self, data, threshold) -> list:
+        """识别图像中的所有人脸"""
+        confs, bboxes, features = await self.represent_async(data, multi_face=True)
+        return await self.executor.run(self.match_faces, confs, bboxes, features, threshold)
+
+    def create_tracker(self) -> FaceTracker:
+        """为一个 websocket 连接创建人脸跟踪器"""
+        return FaceTracker(
+            iou_threshold=server_config.TRACK_IOU_THRESHOLD,
+            refresh_interval=server_config.TRACK_REFRESH_SECONDS,
+            max_age=server_config.TRACK_MAX_AGE_SECONDS,
+            quality_gain=server_config.TRACK_QUALITY_GAIN,
+        )
+
+    def submit_crops(self, aligned_bgr_imgs: np.ndarray) -> Future:
+        """对已对齐的人脸推理，返回 (N, 512) 特征向量的 Future"""
+        if server_config.INFERENCE_MODE == "process":
+            return procpool.submit_crops(aligned_bgr_imgs)
+        return self.batch_scheduler.submit_many(aligned_bgr_imgs)
+
+    def detect_tracks(self, tracker: FaceTracker, data) -> tuple:
+        """
+        检测视频帧中的人脸并更新轨迹，提交需要刷新的人脸推理后立即返回
+        Returns:
+        tuple: (时间, 轨迹, 需要刷新的检测序号, 特征向量的 Future 或 None)
+        """
+        now = time.monotonic()
+        try:
+            np_image = self.ada_face_feature.decode(data)
+        except Exception as err:
+            raise ValueError(f"无法提取脸部特征向量, caused by:{err}") from err
+        try:
+            confs, bboxes, landmarks = self.ada_face_feature.detect_faces(np_image)
+        except ValueError:  # 没有人脸的帧只让轨迹老化
+            confs, bboxes, landmarks = np.empty(0), np.empty((0, 4)), np.empty((0, 10))
+        tracks, refresh = tracker.update(confs, bboxes, now)
+        if not refresh:
+            return now, tracks, refresh, None
+        aligned_bgr_imgs = self.ada_face_feature.align_faces(
+            np_image, bboxes[refresh], landmarks[refresh]
+        )
+        return now, tracks, refresh, self.submit_crops(aligned_bgr_imgs)
+
+    def match_tracks(self, now: float, tracks: list, refresh: list, features, threshold) -> list:
+        """检索刷新的轨迹并返回所有轨迹的结果"""
+        if refresh:
+            results = self.face_database.searchSimilarFacesBatch(features, threshold)
+            for det, feature, result in zip(refresh, features, results):
+                tracks[det].update(feature[np.newaxis], result, now)
+        refreshed = set(refresh)
+        return [
+            {
+                "track_id": track.track_id,
+                "bbox": [int(v) for v in track.bbox],
+                "confidence": track.confidence,
+                "most_similar_face": None if track.result is None else track.result[0],
+                "distance": None if track.result is None else track.result[1],
+                "refreshed": det in refreshed,
+            }
+            for det, track in enumerate(tracks)
+        ]
+
+    async def track_faces(self, tracker: FaceTracker, data, threshold) -> list:
+        """
+        识别视频帧中的所有人脸并跟踪，只对新轨迹、到达刷新间隔或检测置信度
+        明显提高的轨迹重新推理与检索，其余轨迹沿用上一次的结果
+        """
+        now, tracks, refresh, future = await self.executor.run(self.detect_tracks, tracker, data)
+        if future is None:  # 没有需要检索的轨迹
+            return self.match_tracks(now, tracks, refresh, None, threshold)
+        features = await asyncio.wrap_future(future)
+        return await self.executor.run(self.match_tracks, now, tracks, refresh, features, threshold)
+
+    async def verify_face(self, data, threshold) -> tuple:
+        try:
+            feature = await self.represent_async(data)
+            result = await self.executor.run(
+                self.face_database.searchSimilarFaces, feature, threshold
             )
+        except ServerBusyError:
+            raise
         except Exception as err:
             result = (None, err)
         return result
 
 
+    def add_faces(self, items: list) -> list:
+        """
+        批量录入，所有图像一起提交批处理推理，再一次写入数据库
+        Parameters:
+        items: (图像字节, 人脸 id, 身份或 None) 列表
+        Returns:
+        list: 每张图像对应 None 或错误信息
+        """
+        features = self.get_represent_many([data for data, _, _ in items])
+        errors = [str(feature) if isinstance(feature, Exception) else None for feature in features]
+        existing = self.face_database.name_to_id
+        seen = set()  # 本批次内重复的人脸 id
+        accepted = []
+        for i, (_, face_id, identity) in enumerate(items):
+            if errors[i] is not None:
+                continue
+            if str(face_id) in existing or str(face_id) in seen:
+                errors[i] = f"face id already exists: {face_id}"
+                continue
+            seen.add(str(face_id))
+            accepted.append(i)
+        if accepted:
+            try:
+                self.face_database.addFaces(
+                    [items[i][1] for i in accepted],
+                    np.concatenate([features[i] for i in accepted]),
+                    [items[i][2] if items[i][2] is not None else items[i][1] for i in accepted],
+                )
+            except Exception as err:
+                for i in accepted:
+                    errors[i] = str(err)
+        return errors
+
+    def add_face(self, data, face_id: str, identity: str | None = None):
+        self.face_database.addFace(face_id, self.get_represent(data), identity)
+
+
 adaface = AdafaceServer()
 procpool = ProcPool()
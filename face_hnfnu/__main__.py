@@ -1,5 +1,8 @@
 import uvicorn
 import asyncio
+import argparse
+import json
+import os
 from face_hnfnu.http_server import app
 from face_hnfnu.log import logger
 from face_hnfnu.__init__ import adaface, procpool
@@ -35,14 +38,120 @@ async def start_server():
     await server.serve()
 
 
-if __name__ == "__main__":
+def serve(args):
     try:
         adaface.startup_event()
-        #procpool.startup_event()
+        if config.INFERENCE_MODE == "process":
+            procpool.startup_event()
         asyncio.run(start_server())
     except KeyboardInterrupt:
         pass
     finally:
         logger.info("Server Shutdown")
-        #procpool.shutdown_event()
+        if config.INFERENCE_MODE == "process":
+            procpool.shutdown_event()
         adaface.shutdown_event()
+
+
+def precision_report(args):
+    """按指定精度加载模型，输出与 fp32 特征向量的余弦相似度报告"""
+    from face_hnfnu.AdaFaceFeature import AdaFaceFeature
+
+    overrides = {
+        "INFERENCE_BACKEND": "torch",
+        "INFERENCE_PRECISION": args.precision,
+        "ADAFACE_JIT": False,
+    }
+    if args.calibration:
+        overrides["CALIBRATION_PATH"] = args.calibration
+    feature = AdaFaceFeature(config=config.model_copy(update=overrides))
+    feature.load_pretrained_model()
+    print(json.dumps(feature.accuracy_report, indent=2))
+
+
+def export_onnx(args):
+    """将 checkpoint 导出为 ONNX 模型，供 onnx/openvino 后端使用"""
+    from face_hnfnu.backend import export_onnx
+
+    output_path = export_onnx(config, args.output, opset=args.opset)
+    logger.info(f"exported onnx model to {output_path.as_posix()}")
+
+
+def migrate_index(args):
+    """将现有 Faiss 索引重建为新的索引类型，需要训练时只在采样上训练一次"""
+    from face_hnfnu.ann_index import min_train_size, resolve_factory
+    from face_hnfnu.FaceDatabase import FaceDatabase
+
+    face_db = FaceDatabase(config=config)
+    try:
+        count = len(face_db)
+        factory = args.factory or face_db.index_factory
+        if factory == "auto":
+            factory = resolve_factory(factory, count, config.INDEX_TRAIN_SIZE)
+        elif count < min_train_size(factory, config.INDEX_TRAIN_SIZE):
+            raise SystemExit(
+                f"{factory} needs at least {min_train_size(factory, config.INDEX_TRAIN_SIZE)} "
+                f"vectors to train, the database has {count}"
+            )
+        logger.info(f"migrating {count} vectors: {face_db.factory} -> {factory}")
+        face_db.rebuildIndex(factory)
+        # 显式指定的 factory 不再被按库容量自动切换覆盖
+        face_db.pinIndexFactory(args.factory is not None and args.factory != "auto")
+        face_db.saveDatabase()
+    finally:
+        face_db.close()
+
+
+def ingest(args):
+    """离线批量录入目录下的人脸，录入期间不要同时运行服务"""
+    from face_hnfnu.ingest import ingest_directory
+
+    ingest_directory(config, args.directory, args.workers, args.batch_size, args.commit_batches)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="face_hnfnu")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("serve", help="start the http server (default)")
+    report_parser = subparsers.add_parser(
+        "precision-report", help="compare bf16/int8 embeddings against fp32"
+    )
+    report_parser.add_argument("precision", choices=["bf16", "int8"])
+    report_parser.add_argument("--calibration", help="directory of aligned faces")
+    export_parser = subparsers.add_parser(
+        "export-onnx", help="export the checkpoint for the onnx/openvino backends"
+    )
+    export_parser.add_argument("--output", help="defaults to onnx_model_file")
+    export_parser.add_argument("--opset", type=int, default=17)
+    migrate_parser = subparsers.add_parser(
+        "migrate-index", help="rebuild the faiss index into another index type"
+    )
+    migrate_parser.add_argument(
+        "--factory", help='faiss factory string, e.g. "HNSW32,Flat"; defaults to index_factory'
+    )
+    ingest_parser = subparsers.add_parser(
+        "ingest", help="enrol every image under DIR; sub-directory names become identities"
+    )
+    ingest_parser.add_argument("directory", metavar="DIR")
+    ingest_parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="decode/detect/align processes"
+    )
+    ingest_parser.add_argument("--batch-size", type=int, default=64, help="faces per forward pass")
+    ingest_parser.add_argument(
+        "--commit-batches", type=int, default=64, help="forward passes per database write"
+    )
+    args = parser.parse_args()
+    if args.command == "precision-report":
+        precision_report(args)
+    elif args.command == "export-onnx":
+        export_onnx(args)
+    elif args.command == "migrate-index":
+        migrate_index(args)
+    elif args.command == "ingest":
+        ingest(args)
+    else:
+        serve(args)
+
+
+if __name__ == "__main__":
+    main()
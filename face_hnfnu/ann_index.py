@@ -0,0 +1,95 @@
+"""Faiss 索引类型选择
+
+索引结构由 Faiss factory 字符串描述，例如 ``Flat``、``HNSW32,Flat``、
+``IVF1024,Flat``、``IVF4096,PQ64``、``SQ8``，外层统一包一层 ``IDMap2``
+保存 SQLite 分配的 id。``auto`` 按库容量选择：
+
+- 1 万以下: Flat，精确检索
+- 100 万以下: HNSW32,Flat
+- 500 万以下: IVF{4√n},SQ8，每个向量 512 字节
+- 500 万及以上: IVF{4√n},PQ64，每个向量 64 字节
+
+需要训练的索引只在重建时用一份采样训练一次；样本数量不足时先使用 Flat。
+"""
+import re
+
+import faiss
+import numpy as np
+
+AUTO = "auto"
+
+
+def resolve_factory(factory: str, count: int, train_size: int = 0) -> str:
+    """
+    确定 count 个向量应使用的 factory 字符串
+    Parameters:
+    factory: 配置的 factory 字符串或 "auto"
+    count: 库内向量数量
+    train_size: 训练所需的最少向量数，0 表示按索引类型估算
+    """
+    if factory == AUTO:
+        if count < 10_000:
+            factory = "Flat"
+        elif count < 1_000_000:
+            factory = "HNSW32,Flat"
+        else:
+            nlist = 1 << int(np.log2(4 * np.sqrt(count)))  # 取不超过 4√n 的 2 的幂
+            factory = f"IVF{nlist},SQ8" if count < 5_000_000 else f"IVF{nlist},PQ64"
+    if count < min_train_size(factory, train_size):
+        return "Flat"
+    return factory
+
+
+def min_train_size(factory: str, train_size: int = 0) -> int:
+    """训练该索引所需的最少向量数，无需训练时返回 0"""
+    required = 0
+    ivf = re.search(r"IVF(\d+)", factory)
+    if ivf:
+        required = 39 * int(ivf[1])  # Faiss 建议每个聚类中心至少 39 个样本
+    if re.search(r"PQ\d+", factory):
+        required = max(required, 39 * 256)  # 每个子量化器 256 个中心
+    if re.search(r"SQ\d+", factory):
+        required = max(required, 1000)
+    return max(required, train_size) if required else 0
+
+
+def create_index(
+    dimension: int, factory: str, params: str = "", ef_construction: int = 0
+) -> faiss.IndexIDMap2:
+    """
+    按 factory 字符串创建空的余弦相似度(内积)索引
+    Parameters:
+    params: ParameterSpace 参数，例如 "efSearch=64,nprobe=16"
+    ef_construction: HNSW 建图参数，0 表示使用 Faiss 默认值
+    """
+    index = faiss.index_factory(dimension, f"IDMap2,{factory}", faiss.METRIC_INNER_PRODUCT)
+    inner = faiss.downcast_index(index.index)
+    if ef_construction and isinstance(inner, faiss.IndexHNSW):
+        inner.hnsw.efConstruction = ef_construction
+    if params:
+        faiss.ParameterSpace().set_index_parameters(index, params)
+    return index
+
+
+def build_index(
+    vectors: np.ndarray,
+    ids: np.ndarray,
+    dimension: int,
+    factory: str,
+    params: str = "",
+    ef_construction: int = 0,
+    train_sample: int = 100_000,
+) -> faiss.IndexIDMap2:
+    """
+    创建索引，需要训练时用至多 train_sample 个随机向量训练一次，再写入全部向量
+    """
+    index = create_index(dimension, factory, params, ef_construction)
+    if not index.is_trained:
+        sample = vectors
+        if len(vectors) > train_sample:
+            rng = np.random.default_rng(0)
+            sample = vectors[rng.choice(len(vectors), train_sample, replace=False)]
+        index.train(np.ascontiguousarray(sample))
+    if len(vectors):
+        index.add_with_ids(vectors, ids)
+    return index
@@ -0,0 +1,250 @@
+"""特征提取推理后端
+
+所有后端的输入都是 (N, 3, 112, 112) 已归一化的 BGR float32 数组，
+输出 (N, 512) 已 L2 归一化的 float32 特征向量。torch 只在 TorchBackend
+和导出 ONNX 时才会被导入。
+"""
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from face_hnfnu.Config import ConfigModel
+from face_hnfnu.log import logger
+from face_hnfnu.preprocess import IMAGE_SUFFIXES, normalize_into
+
+
+def load_calibration_faces(calibration_path: str) -> np.ndarray:
+    """读取校准目录下已对齐的人脸图像，返回 (N, 112, 112, 3) 的 BGR 数组"""
+    faces = []
+    for path in sorted(Path(calibration_path).iterdir()):
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            continue
+        bgr_img = cv2.imread(path.as_posix(), cv2.IMREAD_COLOR)
+        if bgr_img is None:
+            continue
+        if bgr_img.shape[:2] != (112, 112):
+            bgr_img = cv2.resize(bgr_img, (112, 112), interpolation=cv2.INTER_AREA)
+        faces.append(bgr_img)
+    if not faces:
+        raise ValueError(f"no calibration faces found in {calibration_path}")
+    return np.stack(faces)
+
+
+def onnx_model_path(config: ConfigModel) -> Path:
+    """ONNX 模型路径，未配置时与 checkpoint 同名"""
+    if config.ONNX_MODEL_FILE:
+        return Path(config.ONNX_MODEL_FILE)
+    return Path(config.ADAFACE_MODEL_FILE).with_suffix(".onnx")
+
+
+class InferenceBackend(ABC):
+    """推理后端基类"""
+
+    accuracy_report: dict | None = None
+
+    def __init__(self, config: ConfigModel) -> None:
+        self.config = config
+
+    @abstractmethod
+    def load(self) -> "InferenceBackend":
+        """加载模型，返回自身"""
+
+    @abstractmethod
+    def __call__(self, batch_input: np.ndarray) -> np.ndarray:
+        """(N, 3, 112, 112) 输入推理为 (N, 512) 特征向量"""
+
+
+class TorchBackend(InferenceBackend):
+    """PyTorch eager / TorchScript 后端，支持 fp32、bf16 与 int8"""
+
+    def __init__(self, config: ConfigModel) -> None:
+        super().__init__(config)
+        from face_hnfnu.model_cache import ModelCache
+
+        self.architecture = config.ADAFACE_MODEL
+        self.checkpoint = config.ADAFACE_MODEL_FILE
+        self.fuse = config.ADAFACE_FUSE
+        self.jit = config.ADAFACE_JIT
+        self.precision = config.INFERENCE_PRECISION
+        self.calibration_path = config.CALIBRATION_PATH
+        self.model_cache = (
+            ModelCache(config.MODEL_CACHE_PATH) if config.MODEL_CACHE_PATH else None
+        )
+
+    def load_eager_model(self, model_statedict=None):
+        """构建结构并加载 checkpoint 权重，返回 eval 模式的原始模型"""
+        import torch
+        from face_hnfnu.net import build_model
+
+        if model_statedict is None:
+            statedict = torch.load(
+                self.checkpoint, map_location=torch.device("cpu"), weights_only=True
+            )["state_dict"]
+            model_statedict = {
+                key[6:]: val for key, val in statedict.items() if key.startswith("model.")
+            }
+        model = build_model(self.architecture, init_weights=False)
+        model.load_state_dict(model_statedict)
+        model.eval()
+        return model, model_statedict
+
+    def load(self) -> "TorchBackend":
+        """加载模型"""
+        import torch
+
+        if self.config.TORCH_THREADS > 0:  # 算子内线程数对整个进程生效，只在加载时设置一次
+            torch.set_num_threads(self.config.TORCH_THREADS)
+        if self.precision == "int8":
+            torch.backends.quantized.engine = "x86"
+        artifact, model_statedict = None, None
+        if self.model_cache is not None:
+            artifact = self.model_cache.artifact_path(
+                self.checkpoint, self.architecture, self.jit, self.precision
+            )
+            if artifact.is_file():
+                cached = self.model_cache.load(artifact, self.jit)
+                if self.jit:  # freeze 后的模型写入缓存前已校验过
+                    self.model = cached
+                    return self
+                model_statedict, artifact = cached, None
+        model, model_statedict = self.load_eager_model(model_statedict)
+        self.model = self.optimize_model(model)
+        if artifact is not None:  # 首次加载，写入缓存
+            self.model_cache.save(artifact, self.model if self.jit else model_statedict)
+        return self
+
+    def optimize_model(self, model):
+        """折叠 BatchNorm/Dropout，按精度模式量化，并可选 TorchScript freeze
+
+        fp32/bf16 下输出需与原模型一致；int8 只输出余弦相似度报告。
+        """
+        import torch
+        from face_hnfnu.optimize import (
+            fuse_model,
+            freeze_model,
+            verify_model,
+            quantize_model,
+            precision_report,
+        )
+
+        if self.precision not in ("fp32", "bf16", "int8"):
+            raise ValueError(f"not a correct precision: {self.precision}")
+        optimized = model
+        if self.fuse:
+            optimized = fuse_model(optimized)
+            verify_model(model, optimized)
+        calibration = None
+        if self.calibration_path and Path(self.calibration_path).is_dir():
+            faces = load_calibration_faces(self.calibration_path)
+            calibration = torch.from_numpy(
+                normalize_into(faces, np.empty((len(faces), 3, 112, 112), np.float32))
+            )
+        if self.precision == "int8":
+            if calibration is None:
+                raise ValueError("int8 precision requires calibration faces")
+            optimized = quantize_model(optimized, calibration)
+        if self.jit:
+            optimized = freeze_model(optimized)
+            if self.precision != "int8":
+                verify_model(model, optimized)
+        if self.precision != "fp32":
+            inputs = calibration if calibration is not None else torch.rand(16, 3, 112, 112) * 2 - 1
+            self.accuracy_report = precision_report(
+                model, optimized, inputs, bf16=self.precision == "bf16"
+            )
+            logger.info(f"{self.precision} accuracy report: {self.accuracy_report}")
+        return optimized
+
+    def __call__(self, batch_input: np.ndarray) -> np.ndarray:
+        import torch
+
+        with torch.inference_mode(), torch.autocast(
+            "cpu", dtype=torch.bfloat16, enabled=self.precision == "bf16"
+        ):
+            feature, _ = self.model(torch.from_numpy(batch_input))
+        return feature.float().numpy()
+
+
+class OnnxBackend(InferenceBackend):
+    """onnxruntime CPU 后端"""
+
+    def load(self) -> "OnnxBackend":
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = (
+            onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        options.intra_op_num_threads = self.config.TORCH_THREADS
+        self.session = onnxruntime.InferenceSession(
+            onnx_model_path(self.config).as_posix(),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        # 按位置取第一个输出，不依赖导出时的命名，其他工具导出的模型也可以使用
+        self.output_name = self.session.get_outputs()[0].name
+        return self
+
+    def __call__(self, batch_input: np.ndarray) -> np.ndarray:
+        feature = self.session.run([self.output_name], {self.input_name: batch_input})[0]
+        return feature
+
+
+class OpenVinoBackend(InferenceBackend):
+    """OpenVINO CPU 后端，直接读取导出的 ONNX 模型"""
+
+    def load(self) -> "OpenVinoBackend":
+        import openvino
+
+        core = openvino.Core()
+        self.compiled_model = core.compile_model(
+            onnx_model_path(self.config).as_posix(),
+            "CPU",
+            {"INFERENCE_NUM_THREADS": self.config.TORCH_THREADS},
+        )
+        self.output = self.compiled_model.output(0)  # 同 OnnxBackend，按位置取第一个输出
+        return self
+
+    def __call__(self, batch_input: np.ndarray) -> np.ndarray:
+        return self.compiled_model(batch_input)[self.output]
+
+
+BACKENDS = {
+    "torch": TorchBackend,
+    "onnx": OnnxBackend,
+    "openvino": OpenVinoBackend,
+}
+
+
+def create_backend(config: ConfigModel) -> InferenceBackend:
+    """按配置创建推理后端"""
+    if config.INFERENCE_BACKEND not in BACKENDS:
+        raise ValueError("not a correct inference backend", config.INFERENCE_BACKEND)
+    return BACKENDS[config.INFERENCE_BACKEND](config)
+
+
+def export_onnx(config: ConfigModel, output_path: Path | None = None, opset: int = 17) -> Path:
+    """将 checkpoint 导出为 ONNX 模型(折叠 BatchNorm 后的 fp32 模型，批大小可变)"""
+    import torch
+    from face_hnfnu.optimize import fuse_model
+
+    backend = TorchBackend(config)
+    model, _ = backend.load_eager_model()
+    if config.ADAFACE_FUSE:
+        model = fuse_model(model)
+    output_path = Path(output_path) if output_path else onnx_model_path(config)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            torch.zeros(1, 3, 112, 112),
+            output_path.as_posix(),
+            input_names=["input"],
+            output_names=["embedding", "norm"],
+            dynamic_axes={"input": {0: "batch"}, "embedding": {0: "batch"}, "norm": {0: "batch"}},
+            opset_version=opset,
+        )
+    return output_path
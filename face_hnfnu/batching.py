@@ -0,0 +1,113 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+import numpy as np
+
+from face_hnfnu import metrics
+
+
+class BatchScheduler:
+    """动态微批处理调度器
+
+    将同一时间段内等待的多个对齐人脸(112x112)合并为一个批次，
+    只做一次前向推理，再把每一行结果分发回各自的调用方。
+    """
+
+    def __init__(
+        self,
+        infer_fn: Callable[[list[np.ndarray]], np.ndarray],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+    ) -> None:
+        """
+        Parameters:
+        infer_fn: 批量推理函数，输入若干组 (k, 112, 112, 3) 的对齐人脸，
+            按顺序返回全部 (N, 512) 的特征向量
+        max_batch_size: 单个批次的最大人脸数量
+        max_wait_ms: 收到第一个人脸后最多等待多少毫秒来凑满批次
+        """
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        """启动批处理线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="adaface-batcher", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def stop(self):
+        """停止批处理线程，尚未处理的请求会被取消"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, crop: np.ndarray) -> Future:
+        """提交一个对齐后的人脸，返回其 (1, 512) 特征向量的 Future"""
+        return self.submit_many(crop[np.newaxis])
+
+    def submit_many(self, crops: np.ndarray) -> Future:
+        """提交同一张图像中的多个对齐人脸，返回 (N, 512) 特征向量的 Future"""
+        future = Future()
+        self._queue.put((crops, future))
+        return future
+
+    def _collect(self) -> list | None:
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        rows = len(item[0])
+        deadline = time.monotonic() + self.max_wait
+        while rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = (
+                    self._queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # 处理完当前批次后再退出
+                break
+            batch.append(item)
+            rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            batch = [(crops, fut) for crops, fut in batch if fut.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            metrics.BATCH_ROWS.observe(sum(len(crops) for crops, _ in batch))
+            try:
+                features = self.infer_fn([crops for crops, _ in batch])
+            except Exception as err:
+                for _, fut in batch:
+                    fut.set_exception(err)
+                continue
+            row = 0
+            for crops, fut in batch:
+                fut.set_result(features[row : row + len(crops)])
+                row += len(crops)
+        while True:  # 取消退出后残留的请求
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[1].cancel()
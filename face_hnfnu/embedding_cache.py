@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _nbytes(value) -> int:
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    return 0
+
+
+def _freeze(value):
+    """
+    缓存中的数组复制为独立且只读的数组：批处理结果是整批特征的切片视图，
+    直接缓存会让整批数组一直留在内存中；只读避免调用方修改后影响其他请求
+    """
+    if isinstance(value, np.ndarray):
+        value = value.copy()
+        value.setflags(write=False)
+        return value
+    if isinstance(value, tuple):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class EmbeddingCache:
+    """按上传图像内容哈希缓存特征向量
+
+    键为原始图像字节的 blake2b 摘要，字节完全相同的图像直接返回缓存的
+    结果，跳过解码、检测、对齐与推理。按 LRU 淘汰，总字节数不超过
+    ``max_bytes``，超过 ``ttl`` 秒的条目视为过期。
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = 300.0) -> None:
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[bytes, tuple[float, int, object]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data, namespace: str = "") -> bytes:
+        """图像字节的摘要，namespace 区分同一图像的不同处理方式(单人脸 / 多人脸)"""
+        digest = hashlib.blake2b(data, digest_size=16, person=namespace.encode()[:16])
+        return digest.digest()
+
+    def get(self, key: bytes):
+        """返回缓存的结果，未命中或已过期时返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: bytes, value):
+        """写入结果，超出字节上限时淘汰最久未使用的条目"""
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        value = _freeze(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: bytes):
+        _, size, _ = self._entries.pop(key)
+        self.nbytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> dict:
+        """命中 / 未命中计数与当前占用"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,53 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class ServerBusyError(RuntimeError):
+    """推理队列已满时抛出，调用方应返回 503"""
+
+
+class InferenceExecutor:
+    """常驻的有界推理线程池
+
+    线程数固定为 ``max_workers``，正在执行与排队中的任务总数不超过
+    ``max_workers + queue_size``，超出时直接拒绝而不是无限排队。
+    """
+
+    def __init__(self, max_workers: int, queue_size: int):
+        # torch 的算子内线程数是进程级设置，由 TorchBackend.load 在启动时设置一次
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="adaface-infer"
+        )
+        self.capacity = max_workers + queue_size
+        self.in_flight = 0  # 正在执行与排队中的任务数
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._count_lock = threading.Lock()
+
+    def submit(self, fn, *args) -> Future:
+        """提交任务，队列已满时抛出 ServerBusyError"""
+        if not self._slots.acquire(blocking=False):
+            raise ServerBusyError("服务繁忙，推理队列已满")
+        self._count(1)
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future
+
+    def _count(self, delta: int):
+        with self._count_lock:
+            self.in_flight += delta
+
+    def _release(self):
+        self._count(-1)
+        self._slots.release()
+
+    async def run(self, fn, *args):
+        """在事件循环中等待任务完成"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
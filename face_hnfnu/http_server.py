@@ -1,21 +1,27 @@
+import asyncio
+import posixpath
+import time
+import zipfile
 from fastapi import (
     FastAPI,
     HTTPException,
     Depends,
+    Header,
+    Request,
     UploadFile,
     File,
     WebSocket,
     WebSocketDisconnect,
 )
-import concurrent.futures as futures
-from asyncio import get_event_loop
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from face_hnfnu.__init__ import adaface, procpool
+from face_hnfnu.executor import ServerBusyError
 from face_hnfnu.log import logger
+from face_hnfnu.preprocess import IMAGE_SUFFIXES
+from face_hnfnu.streaming import FairScheduler, LatestFrameBuffer
+from face_hnfnu import metrics, wire
 from face_hnfnu.Config import server_config as config
-from PIL import Image
-import io
 
 app = FastAPI(
     title="AdaFace API",
@@ -24,58 +30,317 @@ app = FastAPI(
 )  # create a FastAPI app
 
 
+# websocket 连接之间轮转分配推理并发数；推理线程只执行检测、对齐与检索，等待批处理时不占用
+# 线程，放行数需要覆盖一个正在推理的批次和一个正在凑满的批次
+fair_scheduler = FairScheduler(config.THREAD_COUNT + 2 * config.BATCH_MAX_SIZE)
+
+# 以下指标在 /metrics 被抓取时才读取
+metrics.gauge_function(
+    "adaface_executor_in_flight", "推理线程池中正在执行与排队的任务数", lambda: adaface.executor.in_flight
+)
+metrics.gauge_function(
+    "adaface_executor_capacity", "推理线程池可容纳的任务数，超出时返回 503", lambda: adaface.executor.capacity
+)
+metrics.gauge_function("adaface_gallery_size", "人脸库中的向量数", lambda: len(adaface.face_database))
+metrics.gauge_function(
+    "adaface_embedding_cache_hits_total", "特征缓存命中次数", lambda: adaface.embedding_cache.hits, "counter"
+)
+metrics.gauge_function(
+    "adaface_embedding_cache_misses_total", "特征缓存未命中次数", lambda: adaface.embedding_cache.misses, "counter"
+)
+metrics.gauge_function(
+    "adaface_embedding_cache_bytes", "特征缓存占用的字节数", lambda: adaface.embedding_cache.nbytes
+)
+
+
+def busy_response(err: ServerBusyError) -> JSONResponse:
+    """推理队列已满时返回 503，提示客户端稍后重试"""
+    return JSONResponse(
+        status_code=503,
+        content={"result": "False", "error": str(err)},
+        headers={"Retry-After": "1"},
+    )
+
+
 @app.get("/live")  # define a route for the live probe
 async def _live():
     """服务存活探针接口"""
     return {"result": "OK"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)  # Prometheus metrics
+async def _metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/embedding_cache")  # hit/miss counters of the embedding cache
+async def _embedding_cache():
+    if adaface.embedding_cache is None:
+        return {"result": "False", "error": "embedding cache is disabled"}
+    return {"result": "True", **adaface.embedding_cache.stats()}
+
+
+async def recognize_frame(data, multi_face: bool, tracker) -> dict:
+    """识别 websocket 收到的一帧，返回要发送给客户端的结果"""
+    try:
+        if tracker is not None:
+            faces = await adaface.track_faces(tracker, data, config.SIMILARITY_THRESHOLD)
+            return {"result": "True", "faces": faces}
+        if multi_face:
+            faces = await adaface.verify_faces(data, config.SIMILARITY_THRESHOLD)
+            return {"result": "True", "faces": faces}
+        thisresult = await adaface.verify_face(data, config.SIMILARITY_THRESHOLD)
+        if thisresult is None:
+            return {"result": "False", "error": "No similar face found"}
+        elif thisresult is not None and thisresult[0] is not None:
+            return {
+                "result": "True",
+                "most_similar_face": thisresult[0],
+                "distance": thisresult[1],
+            }
+        else:
+            raise thisresult[1]
+    except ServerBusyError as err:
+        return {"result": "False", "error": f"{str(err)}", "busy": True}
+    except ValueError as err:
+        return {"result": "False", "error": f"{str(err)}"}
+    except Exception as err:
+        logger.error(f"verify face failed with error: {str(err)}")
+        return {"result": "False", "error": f"{str(err)}"}
+
+
+async def recognize_message(message: bytes, protocol: str, multi_face: bool, tracker) -> tuple:
+    """
+    按连接协商的协议解析一条消息并识别
+    Returns:
+    tuple: (二进制帧头中的 seq，image 协议为 None, 结果)
+    """
+    if protocol == "binary":
+        try:
+            seq, data = wire.parse_frame(message)
+        except ValueError as err:
+            return None, {"result": "False", "error": str(err)}
+    else:
+        seq, data = None, message
+    return seq, await recognize_frame(data, multi_face, tracker)
+
+
+async def recognize_burst(messages: list, protocol: str, k: int, aggregate: str | None) -> list:
+    """
+    通过 verify_batch 识别一组帧：所有帧的人脸合并进同一批次推理，一次 Faiss 检索
+    Returns:
+    list: 每帧对应 (seq, 结果)，结果中附带最相似的一项以兼容 struct 回复
+    """
+    seqs, datas, replies = [], [], []
+    for message in messages:
+        if protocol == "binary":
+            try:
+                seq, data = wire.parse_frame(message)
+            except ValueError as err:
+                replies.append((None, {"result": "False", "error": str(err)}))
+                continue
+        else:
+            seq, data = None, message
+        seqs.append(len(replies))
+        replies.append((seq, None))
+        datas.append(data)
+    if not datas:
+        return replies
+    try:
+        results = await adaface.executor.run(
+            adaface.verify_batch, datas, k, config.SIMILARITY_THRESHOLD, aggregate
+        )
+    except ServerBusyError as err:
+        results = [{"result": "False", "error": str(err), "busy": True} for _ in datas]
+    except Exception as err:
+        logger.error(f"verify batch failed with error: {str(err)}")
+        results = [{"result": "False", "error": str(err)} for _ in datas]
+    for i, payload in zip(seqs, results):
+        matches = payload.get("matches")
+        if matches:
+            top = matches[0]
+            payload["most_similar_face"] = top["face_id" if aggregate is None else "identity"]
+            payload["distance"] = top["distance" if aggregate is None else "score"]
+        elif matches is not None:
+            payload.update(result="False", error="No similar face found")
+        replies[i] = (replies[i][0], payload)
+    return replies
+
+
+async def send_payload(websocket: WebSocket, payload: dict, seq: int | None, reply: str):
+    """按连接协商的格式发送结果，json 之外以二进制消息发送"""
+    if reply == "json":
+        if seq is not None:
+            payload["seq"] = seq
+        await websocket.send_json(payload)
+    else:
+        await websocket.send_bytes(wire.pack_reply(payload, seq or 0, reply))
+
+
+async def stream_frames(
+    websocket: WebSocket, client_id: str, multi_face: bool, tracker, protocol: str, reply: str
+):
+    """
+    最新帧优先模式：接收任务持续读取并只保留最新一帧，本任务逐帧取最新帧处理
+    每个结果附带帧序号、累计丢弃帧数与处理完成时间
+    被丢弃的帧不会被解析，原始像素帧的颜色转换只发生在实际处理的帧上
+    """
+    frames = LatestFrameBuffer()
+
+    async def receive():
+        try:
+            while True:
+                frames.put(await websocket.receive_bytes())
+        finally:
+            frames.close()
+
+    receiver = asyncio.create_task(receive())
+    try:
+        while (frame := await frames.get()) is not None:
+            number, message = frame
+            async with fair_scheduler.slot(client_id):
+                seq, payload = await recognize_message(message, protocol, multi_face, tracker)
+            payload.update(frame=number, dropped=frames.dropped, processed_at=time.time())
+            await send_payload(websocket, payload, number if seq is None else seq, reply)
+    finally:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+
+
+async def burst_frames(
+    websocket: WebSocket,
+    client_id: str,
+    protocol: str,
+    reply: str,
+    burst: int,
+    k: int,
+    aggregate: str | None,
+):
+    """
+    突发模式：接收任务持续读取帧，本任务每次取出已到达的帧(最多 burst 帧)，
+    通过 verify_batch 一起推理与检索，再按到达顺序逐帧返回结果
+    """
+    messages: asyncio.Queue = asyncio.Queue(maxsize=burst * 2)  # 处理跟不上时反压接收
+
+    async def receive():
+        try:
+            while True:
+                await messages.put(await websocket.receive_bytes())
+        finally:
+            while not messages.empty():  # 连接已断开，未处理的帧无法再返回结果
+                messages.get_nowait()
+            messages.put_nowait(None)
+
+    receiver = asyncio.create_task(receive())
+    number = 0
+    try:
+        while (message := await messages.get()) is not None:
+            batch = [message]
+            while len(batch) < burst and not messages.empty():
+                if (message := messages.get_nowait()) is None:
+                    return
+                batch.append(message)
+            async with fair_scheduler.slot(client_id):
+                replies = await recognize_burst(batch, protocol, k, aggregate)
+            for seq, payload in replies:
+                number += 1
+                payload.update(frame=number, burst=len(batch), processed_at=time.time())
+                await send_payload(websocket, payload, number if seq is None else seq, reply)
+    finally:
+        receiver.cancel()
+        await asyncio.gather(receiver, return_exceptions=True)
+
+
 @app.websocket("/ws/{client_id}")  # define a websocket route for the face recognition
-async def websocket_endpoint(websocket: WebSocket, client_id: str):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    client_id: str,
+    multi_face: bool = False,
+    track: bool = False,
+    stream: bool = False,
+    protocol: str = "image",
+    reply: str = "json",
+    burst: int = 0,
+    k: int = 1,
+    aggregate: str | None = None,
+):
+    """
+    protocol: image 为编码图像字节；binary 为带帧头的原始像素帧，见 face_hnfnu.wire
+    reply: json / msgpack / struct
+    burst: 大于 0 时为突发模式，已到达的至多 burst 帧通过 verify_batch 一起识别，
+        每帧返回 top-k，aggregate 为 max / mean 时按身份聚合；不能与
+        multi_face / track / stream 同时使用
+    """
+    if (
+        protocol not in ("image", "binary")
+        or reply not in ("json", "msgpack", "struct")
+        or (reply == "msgpack" and wire.msgpack is None)
+        or burst < 0
+        or (burst > 0 and (multi_face or track or stream or k < 1))
+        or aggregate not in (None, "max", "mean")
+    ):
+        await websocket.close(code=1008, reason="unsupported protocol or reply format")
+        return
     await websocket.accept()
     logger.info(f"websocket connected with client_id: {client_id}")
+    metrics.WEBSOCKET_CONNECTIONS.inc()
+    metrics.WEBSOCKET_CONNECTIONS_TOTAL.inc()
+    tracker = adaface.create_tracker() if track else None  # 跟踪连续帧中的人脸，只对新轨迹推理
     try:
+        if burst > 0:
+            await burst_frames(websocket, client_id, protocol, reply, burst, k, aggregate)
+            return
+        if stream:
+            await stream_frames(websocket, client_id, multi_face, tracker, protocol, reply)
+            return
         while True:
-            try:
-                data = await websocket.receive_bytes()
-                image = Image.open(io.BytesIO(data))
-                with futures.ThreadPoolExecutor() as pool:
-                    thisresult = await get_event_loop().run_in_executor(pool, adaface.verify_face, image, config.SIMILARITY_THRESHOLD)
-                if thisresult is None:
-                    await websocket.send_json(
-                        {"result": "False", "error": "No similar face found"}
-                    )
-                elif thisresult is not None and thisresult[0] is not None:
-                    await websocket.send_json(
-                        {
-                            "result": "True",
-                            "most_similar_face": thisresult[0],
-                            "distance": thisresult[1],
-                        }
-                    )
-                else:
-                    raise thisresult[1]
-            except WebSocketDisconnect as err:
-                raise WebSocketDisconnect(reason=str(err))
-            except ValueError as err:
-                await websocket.send_json(
-                    {"result": "False", "error": f"{str(err)}"}
-                )
-            except Exception as err:
-                logger.error(f"verify face failed with error: {str(err)}")
-                await websocket.send_json(
-                    {"result": "False", "error": f"{str(err)}"}
-                )
+            message = await websocket.receive_bytes()
+            async with fair_scheduler.slot(client_id):
+                seq, payload = await recognize_message(message, protocol, multi_face, tracker)
+            await send_payload(websocket, payload, seq, reply)
     except WebSocketDisconnect:
-        logger.info("websocket disconnected")
+        pass
+    finally:
+        metrics.WEBSOCKET_CONNECTIONS.dec()
+    logger.info("websocket disconnected")
 
-@app.post("/verify")  # verify a face image
-async def _verify(file: UploadFile = File()):
+RAW_CONTENT_TYPES = ("application/octet-stream", "image/")
+
+
+async def read_body(request: Request) -> memoryview:
+    """
+    将请求体直接读入一个 bytearray，不经过 multipart 解析与临时文件
+    有 Content-Length 时按长度预分配，分块写入同一块内存；声明的长度超过上限时
+    不读取直接返回 413，分配的内存不会超过上限
+    """
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    if not content_type.startswith(RAW_CONTENT_TYPES):
+        raise HTTPException(status_code=415, detail="expected application/octet-stream or image/*")
+    limit = config.RAW_BODY_MAX_BYTES
+    length = request.headers.get("content-length")
+    length = int(length) if length and length.isdigit() else 0
+    if length > limit:
+        raise HTTPException(status_code=413, detail=f"body exceeds {limit} bytes")
+    buffer = bytearray(length)
+    size = 0
+    async for chunk in request.stream():
+        end = size + len(chunk)
+        if end > limit:
+            raise HTTPException(status_code=413, detail=f"body exceeds {limit} bytes")
+        if end <= len(buffer):
+            buffer[size:end] = chunk
+        else:
+            del buffer[size:]
+            buffer += chunk
+        size = end
+    if size == 0:
+        raise HTTPException(status_code=400, detail="empty body")
+    return memoryview(buffer)[:size]
+
+
+async def verify_content(content) -> dict | JSONResponse:
     try:
-        content = await file.read()
-        image = Image.open(io.BytesIO(content))
-        with futures.ThreadPoolExecutor() as pool:
-            thisresult = await get_event_loop().run_in_executor(pool, adaface.verify_face, image, config.SIMILARITY_THRESHOLD)
+        thisresult = await adaface.verify_face(content, config.SIMILARITY_THRESHOLD)
         if thisresult is None:
             return {"result": "False", "error": "No similar face found"}
         elif thisresult is not None and thisresult[0] is not None:
@@ -86,31 +351,181 @@ async def _verify(file: UploadFile = File()):
             }
         else:
             raise thisresult[1]
+    except ServerBusyError as err:
+        logger.warning(f"verify face rejected: {str(err)}")
+        return busy_response(err)
     except Exception as err:
         logger.error(f"verify face failed with error: {str(err)}")
         return {"result": "False", "error": str(err)}
 
 
-@app.post("/add_face")  # add a face image to the database
-async def _add_face(file: UploadFile = File()):
+async def verify_faces_content(content) -> dict | JSONResponse:
     try:
-        content = await file.read()
-        image = Image.open(io.BytesIO(content))
-        vector = adaface.ada_face_feature.byte_get_represent(image)
-        adaface.face_database.addFace(file.filename, vector.detach().numpy())
+        faces = await adaface.verify_faces(content, config.SIMILARITY_THRESHOLD)
+        return {"result": "True", "faces": faces}
+    except ServerBusyError as err:
+        logger.warning(f"verify faces rejected: {str(err)}")
+        return busy_response(err)
+    except Exception as err:
+        logger.error(f"verify faces failed with error: {str(err)}")
+        return {"result": "False", "error": str(err)}
+
+
+async def add_face_content(content, face_id: str, identity: str | None) -> dict | JSONResponse:
+    try:
+        await adaface.executor.run(adaface.add_face, content, face_id, identity)
         logger.info("add face success")
         return {"result": "True"}
+    except ServerBusyError as err:
+        logger.warning(f"add face rejected: {str(err)}")
+        return busy_response(err)
     except Exception as err:
         logger.error(f"add face failed with error: {str(err)}")
         return {"result": "False", "error": str(err)}
 
 
+@app.post("/verify")  # verify a face image
+async def _verify(file: UploadFile = File()):
+    return await verify_content(await file.read())
+
+
+@app.post("/verify/raw")  # verify a face image sent as the raw request body
+async def _verify_raw(request: Request):
+    return await verify_content(await read_body(request))
+
+
+@app.post("/verify_faces")  # verify every face in an image
+async def _verify_faces(file: UploadFile = File()):
+    return await verify_faces_content(await file.read())
+
+
+@app.post("/verify_faces/raw")  # verify every face in an image sent as the raw request body
+async def _verify_faces_raw(request: Request):
+    return await verify_faces_content(await read_body(request))
+
+
+@app.post("/verify_batch")  # top-k search for a batch of face images
+async def _verify_batch(
+    files: list[UploadFile] = File(), k: int = 5, aggregate: str | None = None
+):
+    try:
+        contents = [await file.read() for file in files]
+        results = await adaface.executor.run(
+            adaface.verify_batch, contents, k, config.SIMILARITY_THRESHOLD, aggregate
+        )
+        return {"result": "True", "results": results}
+    except ServerBusyError as err:
+        logger.warning(f"verify batch rejected: {str(err)}")
+        return busy_response(err)
+    except Exception as err:
+        logger.error(f"verify batch failed with error: {str(err)}")
+        return {"result": "False", "error": str(err)}
+
+
+@app.post("/add_face")  # add a face image to the database
+async def _add_face(file: UploadFile = File(), identity: str | None = None):
+    return await add_face_content(await file.read(), file.filename, identity)
+
+
+@app.post("/add_face/raw")  # add a face image sent as the raw request body
+async def _add_face_raw(
+    request: Request,
+    face_id: str | None = None,
+    identity: str | None = None,
+    x_face_id: str | None = Header(default=None),
+    x_face_identity: str | None = Header(default=None),
+):
+    """人脸 id 与身份可以放在查询参数中，也可以放在 X-Face-Id / X-Face-Identity 请求头中"""
+    face_id = face_id or x_face_id
+    if not face_id:
+        raise HTTPException(status_code=400, detail="face_id query parameter or X-Face-Id header is required")
+    return await add_face_content(await read_body(request), face_id, identity or x_face_identity)
+
+
+def identity_of(face_id: str) -> str | None:
+    """批量录入时以文件所在目录名作为身份，例如 alice/1.jpg 的身份为 alice"""
+    return posixpath.dirname(face_id) or None
+
+
+def add_zip_entries(archive: zipfile.ZipFile, names: list[str]) -> list:
+    """读取压缩包中的一组图像并批量录入"""
+    return adaface.add_faces(
+        [(archive.read(name), name, identity_of(name)) for name in names]
+    )
+
+
+@app.post("/add_faces")  # bulk enrolment from multiple files or a zip archive
+async def _add_faces(
+    files: list[UploadFile] | None = File(None), archive: UploadFile | None = File(None)
+):
+    chunk_size = config.BULK_CHUNK_SIZE
+    added, failed = 0, []
+    try:
+        if archive is not None:
+            zip_file = zipfile.ZipFile(archive.file)
+            names = []
+            for info in zip_file.infolist():
+                if info.is_dir() or posixpath.splitext(info.filename)[1].lower() not in IMAGE_SUFFIXES:
+                    continue
+                # 解压后的大小由 file_size 限定(zipfile 读到该长度为止)，超限的条目不解压
+                if info.file_size > config.RAW_BODY_MAX_BYTES:
+                    failed.append({"face_id": info.filename, "error": "image is too large"})
+                    continue
+                names.append(info.filename)
+            chunks = [names[i : i + chunk_size] for i in range(0, len(names), chunk_size)]
+            for chunk in chunks:
+                errors = await adaface.executor.run(add_zip_entries, zip_file, chunk)
+                added += errors.count(None)
+                failed += [
+                    {"face_id": name, "error": error}
+                    for name, error in zip(chunk, errors)
+                    if error is not None
+                ]
+        for i in range(0, len(files or []), chunk_size):
+            chunk = files[i : i + chunk_size]
+            items = [
+                (await file.read(), file.filename, identity_of(file.filename)) for file in chunk
+            ]
+            errors = await adaface.executor.run(adaface.add_faces, items)
+            added += errors.count(None)
+            failed += [
+                {"face_id": face_id, "error": error}
+                for (_, face_id, _), error in zip(items, errors)
+                if error is not None
+            ]
+        logger.info(f"add faces: {added} added, {len(failed)} failed")
+        return {"result": "True", "added": added, "failed": failed}
+    except ServerBusyError as err:
+        logger.warning(f"add faces rejected after {added} faces: {str(err)}")
+        return busy_response(err)
+    except Exception as err:
+        logger.error(f"add faces failed with error: {str(err)}")
+        return {"result": "False", "added": added, "error": str(err)}
+
+
 @app.post("/remove_face")  # remove a face image from the database
 async def _remove_face(face_id: str):
     try:
-        adaface.face_database.removeFaceById(face_id)
+        await adaface.executor.run(adaface.face_database.removeFaceById, face_id)
         logger.info("remove face success")
         return {"result": "True"}
+    except ServerBusyError as err:
+        logger.warning(f"remove face rejected: {str(err)}")
+        return busy_response(err)
     except Exception as err:
         logger.error(f"remove face failed with error: {str(err)}")
         return {"result": "False", "error": str(err)}
+
+
+@app.post("/reload_index")  # hot-swap to the latest index snapshot on disk
+async def _reload_index():
+    try:
+        await adaface.executor.run(adaface.face_database.reloadDatabase)
+        logger.info("reload index success")
+        return {"result": "True", "faces": len(adaface.face_database)}
+    except ServerBusyError as err:
+        logger.warning(f"reload index rejected: {str(err)}")
+        return busy_response(err)
+    except Exception as err:
+        logger.error(f"reload index failed with error: {str(err)}")
+        return {"result": "False", "error": str(err)}
@@ -0,0 +1,116 @@
+"""离线批量录入
+
+``python -m face_hnfnu ingest DIR`` 遍历目录下的图像，解码、检测、对齐在
+多个进程中并行完成，特征提取按批次在主进程推理，每 commit_batches 个批次在
+一个 SQLite 事务内写入人脸 id，并一次写入 Faiss 索引与增删日志。人脸 id 为相对
+DIR 的路径，所在子目录名作为身份；已写入的人脸 id 会被跳过，中断后重新运行只会
+重做最后一组未写入的批次。
+"""
+import time
+from collections import deque
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+
+from face_hnfnu import worker
+from face_hnfnu.AdaFaceFeature import AdaFaceFeature
+from face_hnfnu.Config import ConfigModel
+from face_hnfnu.FaceDatabase import FaceDatabase
+from face_hnfnu.log import logger
+from face_hnfnu.preprocess import IMAGE_SUFFIXES
+
+
+def scan_images(directory: Path) -> list[tuple[str, str | None, Path]]:
+    """返回目录下所有图像的 (人脸 id, 身份, 路径)，按路径排序"""
+    images = []
+    for path in sorted(directory.rglob("*")):
+        if path.suffix.lower() not in IMAGE_SUFFIXES or not path.is_file():
+            continue
+        relative = path.relative_to(directory)
+        identity = relative.parent.as_posix() if relative.parent != Path(".") else None
+        images.append((relative.as_posix(), identity, path))
+    return images
+
+
+def aligned_faces(config: ConfigModel, paths: list[Path], workers: int, chunk_size: int = 16):
+    """
+    在 workers 个进程中对齐图像，按输入顺序逐张返回 (112, 112, 3) 的人脸或错误信息
+    同时在途的任务数有上限，内存占用不随图像数量增长
+    """
+    with get_context("spawn").Pool(
+        workers, initializer=worker.init_align_worker, initargs=(config,)
+    ) as pool:
+        chunks = (
+            [path.as_posix() for path in paths[start : start + chunk_size]]
+            for start in range(0, len(paths), chunk_size)
+        )
+        in_flight = deque()
+        for chunk in chunks:
+            in_flight.append(pool.apply_async(worker.align_files, (chunk,)))
+            if len(in_flight) >= workers * 4:
+                yield from in_flight.popleft().get()
+        while in_flight:
+            yield from in_flight.popleft().get()
+
+
+def ingest_directory(
+    config: ConfigModel,
+    directory: str | Path,
+    workers: int,
+    batch_size: int,
+    commit_batches: int = 64,
+) -> tuple[int, int]:
+    """
+    批量录入目录下的人脸
+    Returns:
+    tuple: (录入数量, 失败数量)
+    """
+    directory = Path(directory)
+    face_db = FaceDatabase(config=config)
+    try:
+        images = [image for image in scan_images(directory) if image[0] not in face_db.name_to_id]
+        logger.info(f"ingesting {len(images)} images from {directory.as_posix()} with {workers} workers")
+        ada_face_feature = AdaFaceFeature(config=config).load_pretrained_model()
+        names, identities, features, crops = [], [], [], []
+        ingested, failed = 0, 0
+        start_time = time.time()
+
+        def flush():
+            # 写入后即使中断，重新运行时这些人脸 id 也会被跳过
+            nonlocal ingested
+            face_db.addFaces(names, np.concatenate(features), identities)
+            ingested += len(names)
+            names.clear(), identities.clear(), features.clear()
+            rate = ingested / (time.time() - start_time)
+            logger.info(f"ingested {ingested}/{len(images)} faces ({rate:.1f} faces/s)")
+
+        def embed():
+            features.append(ada_face_feature.batch_get_represent(np.stack(crops)))
+            crops.clear()
+            if len(features) >= commit_batches:
+                flush()
+
+        faces = aligned_faces(config, [path for _, _, path in images], workers)
+        for (name, identity, path), face in zip(images, faces):
+            if isinstance(face, str):
+                logger.warning(f"skipping {path.as_posix()}: {face}")
+                failed += 1
+                continue
+            names.append(name)
+            identities.append(identity if identity is not None else name)
+            crops.append(face)
+            if len(crops) >= batch_size:
+                embed()
+        if crops:
+            embed()
+        if names:
+            flush()
+        if ingested:
+            face_db.saveDatabase()
+        logger.info(
+            f"ingested {ingested} faces, {failed} failed, in {time.time() - start_time:.1f} seconds"
+        )
+        return ingested, failed
+    finally:
+        face_db.close()
@@ -0,0 +1,169 @@
+"""Prometheus 指标
+
+不依赖 prometheus_client：直方图只是一组定长计数，observe 只做一次二分查找
+和两次加法，不分配新对象；队列深度、库容量等状态在 /metrics 被抓取时才通过
+回调读取。指标只在当前进程内统计，进程池模式下工作进程中的检测、对齐与
+推理耗时不会出现在服务进程的 /metrics 中。
+"""
+import bisect
+import math
+import threading
+from typing import Callable
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name: str, labels: str):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip((*self.buckets, math.inf), counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == math.inf else f'le="{float(bound)!r}"'
+            yield f"{name}_bucket{{{_join(labels, le)}}}", cumulative
+        yield f"{name}_sum{_braces(labels)}", total
+        yield f"{name}_count{_braces(labels)}", cumulative
+
+
+class Counter:
+    def __init__(self) -> None:
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: int = 1):
+        self.inc(-amount)
+
+    def samples(self, name: str, labels: str):
+        yield f"{name}{_braces(labels)}", self.value
+
+
+class Callback:
+    """抓取时调用 fn 取值"""
+
+    def __init__(self, fn: Callable[[], float]) -> None:
+        self.fn = fn
+
+    def samples(self, name: str, labels: str):
+        yield f"{name}{_braces(labels)}", self.fn()
+
+
+def _join(*parts: str) -> str:
+    return ",".join(part for part in parts if part)
+
+
+def _braces(labels: str) -> str:
+    return f"{{{labels}}}" if labels else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+class Family:
+    """同名指标的一组带标签的子指标"""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple, factory) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = labelnames
+        self.factory = factory
+        self.children: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """返回对应标签值的子指标，应在模块加载时取出并复用，而不是每次调用时查找"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        with self._lock:
+            child = self.children.get(values)
+            if child is None:
+                child = self.children[values] = self.factory()
+            return child
+
+    def render(self, lines: list[str]):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        with self._lock:
+            children = list(self.children.items())
+        for values, child in children:
+            labels = ",".join(
+                f'{label}="{_escape(value)}"' for label, value in zip(self.labelnames, values)
+            )
+            try:
+                for sample, value in child.samples(self.name, labels):
+                    lines.append(f"{sample} {value if isinstance(value, int) else float(value)!r}")
+            except Exception:  # 回调失败(例如服务尚未启动完成)时跳过该指标
+                continue
+
+
+_families: dict[str, Family] = {}
+
+
+def _register(name: str, documentation: str, kind: str, labelnames: tuple, factory) -> Family:
+    family = _families.get(name)
+    if family is None:
+        family = _families[name] = Family(name, documentation, kind, labelnames, factory)
+    return family
+
+
+def histogram(name: str, documentation: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Family:
+    return _register(name, documentation, "histogram", labelnames, lambda: Histogram(buckets))
+
+
+def counter(name: str, documentation: str, labelnames: tuple = ()) -> Family:
+    return _register(name, documentation, "counter", labelnames, Counter)
+
+
+def gauge(name: str, documentation: str, labelnames: tuple = ()) -> Family:
+    return _register(name, documentation, "gauge", labelnames, Counter)
+
+
+def gauge_function(name: str, documentation: str, fn: Callable[[], float], kind: str = "gauge"):
+    """注册一个抓取时才取值的指标，重复注册时替换回调"""
+    family = _register(name, documentation, kind, (), lambda: Callback(fn))
+    family.labels().fn = fn
+
+
+def render() -> str:
+    """Prometheus 文本格式的全部指标"""
+    lines: list[str] = []
+    for family in list(_families.values()):
+        family.render(lines)
+    lines.append("")
+    return "\n".join(lines)
+
+
+STAGE_SECONDS = histogram("adaface_stage_seconds", "各处理阶段的耗时(秒)", ("stage",))
+DECODE_SECONDS = STAGE_SECONDS.labels("decode")
+RESIZE_SECONDS = STAGE_SECONDS.labels("resize")
+DETECT_SECONDS = STAGE_SECONDS.labels("detect")
+ALIGN_SECONDS = STAGE_SECONDS.labels("align")
+TO_INPUT_SECONDS = STAGE_SECONDS.labels("to_input")
+FORWARD_SECONDS = STAGE_SECONDS.labels("forward")
+SEARCH_SECONDS = STAGE_SECONDS.labels("search")
+BATCH_ROWS = histogram(
+    "adaface_batch_rows", "批处理调度器每次前向推理的人脸数", buckets=BATCH_BUCKETS
+).labels()
+WEBSOCKET_CONNECTIONS = gauge("adaface_websocket_connections", "当前 websocket 连接数").labels()
+WEBSOCKET_CONNECTIONS_TOTAL = counter(
+    "adaface_websocket_connections_total", "累计 websocket 连接数"
+).labels()
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import torch
+
+
+class ModelCache:
+    """预处理后模型的本地缓存
+
+    首次加载时把去掉 ``model.`` 前缀的 state_dict(或 freeze 后的 TorchScript 模型)
+    按 checkpoint 哈希与模型结构写入缓存目录，之后启动直接加载，
+    跳过 Lightning checkpoint 的完整反序列化。
+    """
+
+    def __init__(self, cache_dir: str | Path) -> None:
+        self.cache_dir = Path(cache_dir)
+
+    def checkpoint_digest(self, checkpoint: Path) -> str:
+        """计算 checkpoint 的 blake2b 哈希，文件大小与修改时间不变时复用上次结果"""
+        stat = checkpoint.stat()
+        memo_path = self.cache_dir / f"{checkpoint.name}.digest.json"
+        try:
+            memo = json.loads(memo_path.read_text())
+            if memo["size"] == stat.st_size and memo["mtime_ns"] == stat.st_mtime_ns:
+                return memo["digest"]
+        except (OSError, ValueError, KeyError):
+            pass
+        with checkpoint.open("rb") as file:
+            digest = hashlib.file_digest(file, "blake2b").hexdigest()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        memo_path.write_text(
+            json.dumps(
+                {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "digest": digest}
+            )
+        )
+        return digest
+
+    def artifact_path(
+        self, checkpoint: str | Path, architecture: str, jit: bool, precision: str = "fp32"
+    ) -> Path:
+        """缓存文件路径，TorchScript 产物额外以精度模式与 torch 版本区分"""
+        digest = self.checkpoint_digest(Path(checkpoint))[:16]
+        if jit:
+            name = f"{architecture}-{digest}-{precision}-torch{torch.__version__}.jit.pt"
+        else:
+            name = f"{architecture}-{digest}.pt"
+        return self.cache_dir / name
+
+    def save(self, path: Path, artifact):
+        """原子地写入缓存文件"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + ".tmp")
+        if isinstance(artifact, torch.jit.ScriptModule):
+            torch.jit.save(artifact, tmp_path.as_posix())
+        else:
+            torch.save(artifact, tmp_path)
+        os.replace(tmp_path, path)
+
+    def load(self, path: Path, jit: bool):
+        """读取缓存文件"""
+        if jit:
+            return torch.jit.load(path.as_posix(), map_location=torch.device("cpu"))
+        return torch.load(path, map_location=torch.device("cpu"), weights_only=True)
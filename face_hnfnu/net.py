@@ -10,17 +10,17 @@ from torch.nn import ReLU, Sigmoid
 from torch.nn import Module
 from torch.nn import PReLU
 
-def build_model(model_name='ir_50'):
+def build_model(model_name='ir_50', init_weights=True):
     if model_name == 'ir_101':
-        return IR_101(input_size=(112,112))
+        return IR_101(input_size=(112,112), init_weights=init_weights)
     elif model_name == 'ir_50':
-        return IR_50(input_size=(112,112))
+        return IR_50(input_size=(112,112), init_weights=init_weights)
     elif model_name == 'ir_se_50':
-        return IR_SE_50(input_size=(112,112))
+        return IR_SE_50(input_size=(112,112), init_weights=init_weights)
     elif model_name == 'ir_34':
-        return IR_34(input_size=(112,112))
+        return IR_34(input_size=(112,112), init_weights=init_weights)
     elif model_name == 'ir_18':
-        return IR_18(input_size=(112,112))
+        return IR_18(input_size=(112,112), init_weights=init_weights)
     else:
         raise ValueError('not a correct model name', model_name)
 
@@ -264,11 +264,12 @@ def get_blocks(num_layers):
 
 
 class Backbone(Module):
-    def __init__(self, input_size, num_layers, mode='ir'):
+    def __init__(self, input_size, num_layers, mode='ir', init_weights=True):
         """ Args:
             input_size: input_size of backbone
             num_layers: num_layers of backbone
             mode: support ir or irse
+            init_weights: skip it when pretrained weights are loaded right after
         """
         super(Backbone, self).__init__()
         assert input_size[0] in [112, 224], \
@@ -312,7 +313,8 @@ class Backbone(Module):
                                 bottleneck.stride))
         self.body = Sequential(*modules)
 
-        initialize_weights(self.modules())
+        if init_weights:
+            initialize_weights(self.modules())
 
 
     def forward(self, x):
@@ -332,82 +334,82 @@ class Backbone(Module):
 
 
 
-def IR_18(input_size):
+def IR_18(input_size, init_weights=True):
     """ Constructs a ir-18 model.
     """
-    model = Backbone(input_size, 18, 'ir')
+    model = Backbone(input_size, 18, 'ir', init_weights=init_weights)
 
     return model
 
 
-def IR_34(input_size):
+def IR_34(input_size, init_weights=True):
     """ Constructs a ir-34 model.
     """
-    model = Backbone(input_size, 34, 'ir')
+    model = Backbone(input_size, 34, 'ir', init_weights=init_weights)
 
     return model
 
 
-def IR_50(input_size):
+def IR_50(input_size, init_weights=True):
     """ Constructs a ir-50 model.
     """
-    model = Backbone(input_size, 50, 'ir')
+    model = Backbone(input_size, 50, 'ir', init_weights=init_weights)
 
     return model
 
 
-def IR_101(input_size):
+def IR_101(input_size, init_weights=True):
     """ Constructs a ir-101 model.
     """
-    model = Backbone(input_size, 100, 'ir')
+    model = Backbone(input_size, 100, 'ir', init_weights=init_weights)
 
     return model
 
 
-def IR_152(input_size):
+def IR_152(input_size, init_weights=True):
     """ Constructs a ir-152 model.
     """
-    model = Backbone(input_size, 152, 'ir')
+    model = Backbone(input_size, 152, 'ir', init_weights=init_weights)
 
     return model
 
 
-def IR_200(input_size):
+def IR_200(input_size, init_weights=True):
     """ Constructs a ir-200 model.
     """
-    model = Backbone(input_size, 200, 'ir')
+    model = Backbone(input_size, 200, 'ir', init_weights=init_weights)
 
     return model
 
 
-def IR_SE_50(input_size):
+def IR_SE_50(input_size, init_weights=True):
     """ Constructs a ir_se-50 model.
     """
-    model = Backbone(input_size, 50, 'ir_se')
+    model = Backbone(input_size, 50, 'ir_se', init_weights=init_weights)
 
     return model
 
 
-def IR_SE_101(input_size):
+def IR_SE_101(input_size, init_weights=True):
     """ Constructs a ir_se-101 model.
     """
-    model = Backbone(input_size, 100, 'ir_se')
+    model = Backbone(input_size, 100, 'ir_se', init_weights=init_weights)
 
     return model
 
 
-def IR_SE_152(input_size):
+def IR_SE_152(input_size, init_weights=True):
     """ Constructs a ir_se-152 model.
     """
-    model = Backbone(input_size, 152, 'ir_se')
+    model = Backbone(input_size, 152, 'ir_se', init_weights=init_weights)
 
     return model
 
 
-def IR_SE_200(input_size):
+def IR_SE_200(input_size, init_weights=True):
     """ Constructs a ir_se-200 model.
     """
-    model = Backbone(input_size, 200, 'ir_se')
+    model = Backbone(input_size, 200, 'ir_se', init_weights=init_weights)
 
     return model
 
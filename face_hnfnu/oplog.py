@@ -0,0 +1,155 @@
+"""Faiss 索引的预写日志
+
+每次增删人脸都以二进制记录追加到日志文件末尾，快照(faiss.write_index)在
+后台定期写入。快照开始时当前日志段被封存为 ``<name>.log.<序号>``，快照
+原子替换成功后删除已封存的日志段；启动时加载最新快照，再按顺序重放剩余的
+日志段。重放是幂等的，快照与删除日志段之间崩溃不会产生重复向量。
+
+记录格式(小端)::
+
+    op: uint8  id: int64  length: uint32  crc32: uint32  payload: length 字节
+
+add 的 payload 是 float32 向量，remove / clear 没有 payload。
+"""
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+from face_hnfnu.log import logger
+
+OP_ADD = 1
+OP_REMOVE = 2
+OP_CLEAR = 3
+
+_RECORD = struct.Struct("<BqII")
+
+
+class OperationLog:
+    """追加写入的增删日志"""
+
+    def __init__(self, path: str | Path, fsync: bool = False) -> None:
+        """
+        Parameters:
+        path: 当前日志段路径，封存的日志段为 path.<序号>
+        fsync: 每次追加后是否 fsync；关闭时进程崩溃不丢数据，断电可能丢失最近的记录
+        """
+        self.path = Path(path)
+        self.fsync = fsync
+        self.pending = 0  # 最近一次快照之后的记录数
+        self._lock = threading.Lock()
+        self._file = None
+
+    def segments(self) -> list[Path]:
+        """按写入顺序返回已封存的日志段"""
+        sealed = self.path.parent.glob(f"{self.path.name}.*")
+        return sorted(
+            (path for path in sealed if path.suffix[1:].isdigit()),
+            key=lambda path: int(path.suffix[1:]),
+        )
+
+    def has_records(self) -> bool:
+        """是否存在尚未被快照包含的日志"""
+        if self.segments():
+            return True
+        return self.path.is_file() and self.path.stat().st_size > 0
+
+    def _write(self, records: bytes, count: int):
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "ab")
+            start = self._file.tell()
+            try:
+                self._file.write(records)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+            except BaseException:
+                # 写入失败(例如磁盘已满)时截掉写了一半的记录，否则之后追加的记录在重放时无法读到
+                file, self._file = self._file, None
+                try:
+                    file.close()
+                except OSError:
+                    pass
+                try:
+                    os.truncate(self.path, start)
+                except OSError as err:
+                    logger.error(f"truncating the torn operation log failed with error: {str(err)}")
+                raise
+            self.pending += count
+
+    def append_add(self, ids, vectors: np.ndarray):
+        """记录一批新增的 (id, 向量)"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        records = []
+        for id, vector in zip(ids, vectors):
+            payload = vector.tobytes()
+            records.append(_RECORD.pack(OP_ADD, int(id), len(payload), zlib.crc32(payload)))
+            records.append(payload)
+        self._write(b"".join(records), len(vectors))
+
+    def append_remove(self, ids):
+        """记录一批删除的 id"""
+        records = b"".join(_RECORD.pack(OP_REMOVE, int(id), 0, 0) for id in ids)
+        self._write(records, len(ids))
+
+    def append_clear(self):
+        """记录清空数据库"""
+        self._write(_RECORD.pack(OP_CLEAR, 0, 0, 0), 1)
+
+    def rotate(self) -> list[Path]:
+        """封存当前日志段，返回全部已封存的日志段，之后的记录写入新的日志段"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            sealed = self.segments()
+            if self.path.is_file():
+                number = int(sealed[-1].suffix[1:]) + 1 if sealed else 1
+                sealed.append(self.path.rename(self.path.with_name(f"{self.path.name}.{number}")))
+            self.pending = 0
+            return sealed
+
+    def discard(self, segments: list[Path]):
+        """删除快照已包含的日志段"""
+        for path in segments:
+            path.unlink(missing_ok=True)
+
+    def replay(self, truncate: bool = True) -> Iterator[tuple[int, int, np.ndarray | None]]:
+        """
+        按顺序读取所有日志段，返回 (op, id, 向量或 None)
+        末尾不完整或校验失败的记录视为崩溃时未写完，truncate 时当前日志段会截断到
+        最后一条完整记录
+        """
+        self.pending = 0
+        for path in [*self.segments(), self.path]:
+            try:
+                data = path.read_bytes()
+            except FileNotFoundError:  # 只读副本读取时，写入进程可能刚删除已封存的日志段
+                continue
+            offset = 0
+            while offset + _RECORD.size <= len(data):
+                op, id, length, crc = _RECORD.unpack_from(data, offset)
+                end = offset + _RECORD.size + length
+                payload = data[offset + _RECORD.size : end]
+                if end > len(data) or zlib.crc32(payload) != crc:
+                    break
+                offset = end
+                self.pending += 1
+                yield op, id, np.frombuffer(payload, dtype=np.float32) if op == OP_ADD else None
+            if offset < len(data) and truncate:
+                logger.warning(f"discarding {len(data) - offset} torn bytes at the end of {path}")
+                if path == self.path:
+                    with open(path, "r+b") as file:
+                        file.truncate(offset)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,157 @@
+"""推理阶段的模型优化
+
+Backbone 训练结构中的 Conv2d+BatchNorm2d、Dropout 以及输出层的 BatchNorm
+在推理时都是固定的线性变换，可以提前折叠进卷积与全连接层的权重中。
+"""
+import copy
+
+import torch
+from torch.nn import BatchNorm1d, BatchNorm2d, Conv2d, Dropout
+from torch.nn import Linear, Module, Sequential
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from face_hnfnu.net import Backbone, Flatten
+
+
+def _bn_scale_shift(bn: BatchNorm1d | BatchNorm2d) -> tuple[torch.Tensor, torch.Tensor]:
+    """BatchNorm 在 eval 模式下等价的 y = x * scale + shift"""
+    scale = torch.rsqrt(bn.running_var + bn.eps)
+    shift = -bn.running_mean * scale
+    if bn.affine:
+        scale = scale * bn.weight
+        shift = shift * bn.weight + bn.bias
+    return scale, shift
+
+
+def fuse_sequential(layers: Sequential) -> Sequential:
+    """折叠 Sequential 中相邻的 Conv2d+BatchNorm2d，并移除 Dropout"""
+    modules = list(layers.children())
+    fused = []
+    idx = 0
+    while idx < len(modules):
+        module = modules[idx]
+        following = modules[idx + 1] if idx + 1 < len(modules) else None
+        if isinstance(module, Conv2d) and isinstance(following, BatchNorm2d):
+            fused.append(fuse_conv_bn_eval(module, following))
+            idx += 2
+            continue
+        if not isinstance(module, Dropout):
+            fused.append(module)
+        idx += 1
+    return Sequential(*fused)
+
+
+def fuse_output_layer(output_layer: Sequential) -> Sequential:
+    """将输出层 BatchNorm2d -> Dropout -> Flatten -> Linear -> BatchNorm1d 折叠为单个 Linear"""
+    bn2d, _dropout, flatten, linear, bn1d = output_layer.children()
+    assert isinstance(bn2d, BatchNorm2d) and isinstance(flatten, Flatten)
+    assert isinstance(linear, Linear) and isinstance(bn1d, BatchNorm1d)
+    weight = linear.weight.detach()
+    bias = (
+        linear.bias.detach()
+        if linear.bias is not None
+        else torch.zeros(linear.out_features, dtype=weight.dtype)
+    )
+
+    # Flatten 按 (C, H, W) 展开，每个通道的缩放重复 H*W 次
+    scale, shift = _bn_scale_shift(bn2d)
+    spatial = linear.in_features // bn2d.num_features
+    bias = bias + weight @ shift.repeat_interleave(spatial)
+    weight = weight * scale.repeat_interleave(spatial)
+
+    scale, shift = _bn_scale_shift(bn1d)
+    weight = weight * scale[:, None]
+    bias = bias * scale + shift
+
+    fused = Linear(linear.in_features, linear.out_features, bias=True)
+    fused.weight.data.copy_(weight)
+    fused.bias.data.copy_(bias)
+    return Sequential(Flatten(), fused)
+
+
+@torch.no_grad()
+def fuse_model(model: Backbone) -> Backbone:
+    """返回折叠了 BatchNorm 与 Dropout 的推理专用模型副本"""
+    fused = copy.deepcopy(model).eval()
+    fused.input_layer = fuse_sequential(fused.input_layer)
+    for block in fused.body:
+        if isinstance(block.shortcut_layer, Sequential):
+            block.shortcut_layer = fuse_sequential(block.shortcut_layer)
+        block.res_layer = fuse_sequential(block.res_layer)
+    fused.output_layer = fuse_output_layer(fused.output_layer)
+    return fused
+
+
+def freeze_model(model: Module, input_size=(112, 112)) -> torch.jit.ScriptModule:
+    """通过 TorchScript trace 并 freeze 模型"""
+    example = torch.zeros(1, 3, *input_size)
+    with torch.no_grad():
+        traced = torch.jit.trace(model.eval(), example)
+    return torch.jit.freeze(traced)
+
+
+@torch.no_grad()
+def verify_model(
+    reference: Module,
+    candidate: Module,
+    batch_size: int = 4,
+    input_size=(112, 112),
+    atol: float = 1e-3,
+) -> float:
+    """
+    校验优化后的模型与原模型输出的特征向量是否一致
+    Returns:
+    float: 最大的逐元素误差，超过 atol 时抛出 ValueError
+    """
+    inputs = torch.rand(batch_size, 3, *input_size) * 2 - 1
+    expected, _ = reference(inputs)
+    actual, _ = candidate(inputs)
+    max_error = float((expected - actual).abs().max())
+    if max_error > atol:
+        raise ValueError(
+            f"optimized model output differs from reference by {max_error:.2e}"
+        )
+    return max_error
+
+
+@torch.no_grad()
+def quantize_model(model: Module, calibration: torch.Tensor, batch_size: int = 32) -> Module:
+    """
+    对 Conv/Linear 做 int8 训练后静态量化
+    Parameters:
+    model: 待量化的模型(建议先 fuse_model)
+    calibration: (N, 3, 112, 112) 的校准输入，用于统计激活值范围
+    """
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    torch.backends.quantized.engine = "x86"
+    prepared = prepare_fx(
+        copy.deepcopy(model).eval(),
+        get_default_qconfig_mapping("x86"),
+        example_inputs=(calibration[:1],),
+    )
+    for batch in calibration.split(batch_size):
+        prepared(batch)
+    return convert_fx(prepared)
+
+
+@torch.no_grad()
+def precision_report(
+    reference: Module, candidate: Module, inputs: torch.Tensor, bf16: bool = False
+) -> dict:
+    """
+    比较候选模型与 fp32 模型输出特征向量的余弦相似度
+    Returns:
+    dict: 样本数、平均/最小余弦相似度
+    """
+    expected, _ = reference(inputs)
+    with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16):
+        actual, _ = candidate(inputs)
+    actual = actual.float()
+    cosine = (expected * actual).sum(dim=1) / actual.norm(dim=1)
+    return {
+        "samples": int(inputs.shape[0]),
+        "mean_cosine": float(cosine.mean()),
+        "min_cosine": float(cosine.min()),
+    }
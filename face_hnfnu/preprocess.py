@@ -0,0 +1,114 @@
+"""图像预处理
+
+上传的图像字节只解码一次，直接得到连续的 BGR uint8 数组，检测、对齐都在
+同一个数组上进行，模型输入在预分配的 float32 缓冲区中一次完成归一化与转置。
+JPEG 通过 libjpeg 的 DCT 缩放直接解码为较小的尺寸。
+"""
+import io
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from face_hnfnu import metrics
+
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+_SCALE = np.float32(2 / 255)  # ((x / 255) - 0.5) / 0.5 == x * 2 / 255 - 1
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def probe_image(data) -> tuple[str | None, int, int]:
+    """只读取图像头，返回 (格式, 宽, 高)，无法识别时返回 (None, 0, 0)"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.format, *image.size
+    except Exception:
+        return None, 0, 0
+
+
+def resize_max(np_image: np.ndarray, max_size: int) -> tuple[np.ndarray, float]:
+    """将最长边缩放至 max_size 以内，返回 (图像, 缩放比例)"""
+    h, w = np_image.shape[:2]
+    if max(h, w) <= max_size:
+        return np_image, 1.0
+    start = time.perf_counter()
+    scale = max_size / max(h, w)
+    resized = cv2.resize(
+        np_image,
+        (max(1, round(w * scale)), max(1, round(h * scale))),
+        interpolation=cv2.INTER_AREA,
+    )
+    metrics.RESIZE_SECONDS.observe(time.perf_counter() - start)
+    return resized, scale
+
+
+def decode_image(data, max_size: int = 960) -> np.ndarray:
+    """
+    将图像字节解码为 BGR 数组，最长边缩放至 max_size 以内
+    JPEG 会按 1/2、1/4、1/8 的 DCT 缩放解码，解码结果不小于 max_size
+    Parameters:
+    data: bytes / bytearray / memoryview，或已解码的 (H, W, 3) BGR 数组(二进制协议的原始像素帧)
+    """
+    if isinstance(data, np.ndarray):
+        return np.ascontiguousarray(resize_max(data, max_size)[0])
+    start = time.perf_counter()
+    flags = cv2.IMREAD_COLOR
+    image_format, w, h = probe_image(data)
+    if image_format == "JPEG":
+        for factor, reduced_flag in _REDUCED_FLAGS:
+            if max(w, h) // factor >= max_size:
+                flags = reduced_flag
+                break
+    np_image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+    if np_image is None:
+        raise ValueError("无法解码图像")
+    metrics.DECODE_SECONDS.observe(time.perf_counter() - start)
+    return resize_max(np_image, max_size)[0]
+
+
+def normalize_into(bgr_faces: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """将 (N, 112, 112, 3) 的 BGR uint8 人脸归一化并转置写入 out (N, 3, 112, 112)"""
+    np.multiply(bgr_faces.transpose(0, 3, 1, 2), _SCALE, out=out)
+    np.subtract(out, 1, out=out)
+    return out
+
+
+class InputBuffer:
+    """每个线程复用的预分配模型输入缓冲区"""
+
+    def __init__(self, max_batch_size: int = 16, image_size=(112, 112)) -> None:
+        self.max_batch_size = max_batch_size
+        self.image_size = tuple(image_size)
+        self._local = threading.local()
+
+    def get(self, batch_size: int) -> np.ndarray:
+        """返回当前线程 (batch_size, 3, H, W) 的 float32 缓冲区视图"""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) < batch_size:
+            buffer = np.empty(
+                (max(batch_size, self.max_batch_size), 3, *self.image_size),
+                dtype=np.float32,
+            )
+            self._local.buffer = buffer
+        return buffer[:batch_size]
+
+    def to_input(self, bgr_faces: np.ndarray | list[np.ndarray]) -> np.ndarray:
+        """
+        将一组或多组对齐人脸直接写入批量输入缓冲区
+        返回的数组在同一线程下一次调用前有效
+        """
+        start = time.perf_counter()
+        groups = bgr_faces if isinstance(bgr_faces, list) else [bgr_faces]
+        batch = self.get(sum(len(faces) for faces in groups))
+        row = 0
+        for faces in groups:
+            normalize_into(faces, batch[row : row + len(faces)])
+            row += len(faces)
+        metrics.TO_INPUT_SECONDS.observe(time.perf_counter() - start)
+        return batch
@@ -0,0 +1,78 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable
+
+
+class SQLiteConnectionManager:
+    """长连接的 SQLite 访问层
+
+    每个线程持有一个常驻连接(WAL 模式，自动提交)，读操作不再开关连接也不再
+    commit；写操作通过 ``transaction`` 显式开启事务，批量写入只提交一次。
+    语句缓存由 sqlite3 的 ``cached_statements`` 负责，相同 SQL 只编译一次。
+    """
+
+    def __init__(self, path: str | Path, cached_statements: int = 128, busy_timeout: float = 5.0):
+        self.path = Path(path)
+        self.cached_statements = cached_statements
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        """当前线程的连接，首次访问时创建"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.path,
+                timeout=self.busy_timeout,
+                isolation_level=None,  # 自动提交，事务由 transaction() 显式控制
+                check_same_thread=False,
+                cached_statements=self.cached_statements,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """写事务，退出时提交，异常时回滚"""
+        conn = self.connection()
+        if conn.in_transaction:  # 嵌套调用时并入外层事务
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def fetchone(self, sql: str, params: tuple = ()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params: tuple = ()) -> list:
+        return self.connection().execute(sql, params).fetchall()
+
+    def execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.transaction() as conn:
+            return conn.execute(sql, params)
+
+    def executemany(self, sql: str, seq_of_params: Iterable[tuple]) -> sqlite3.Cursor:
+        """在一个事务内批量执行，只提交一次"""
+        with self.transaction() as conn:
+            return conn.executemany(sql, seq_of_params)
+
+    def close(self):
+        """关闭所有线程的连接"""
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
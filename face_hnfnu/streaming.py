@@ -0,0 +1,103 @@
+"""websocket 视频流的背压控制
+
+客户端发帧快于推理时，接收任务持续读取并只保留最新一帧，旧帧直接丢弃；
+处理任务每次取最新帧推理。所有连接通过 FairScheduler 轮转分配推理并发数，
+发帧频繁的连接不会挤占其他连接。
+"""
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class LatestFrameBuffer:
+    """只保留最新一帧的单槽缓冲区"""
+
+    def __init__(self) -> None:
+        self.received = 0  # 已接收的帧数，同时作为帧序号
+        self.dropped = 0  # 未被处理就被新帧覆盖的帧数
+        self._frame: tuple[int, bytes] | None = None
+        self._closed = False
+        self._event = asyncio.Event()
+
+    def put(self, data: bytes):
+        """放入新帧，覆盖尚未处理的旧帧"""
+        if self._frame is not None:
+            self.dropped += 1
+        self.received += 1
+        self._frame = (self.received, data)
+        self._event.set()
+
+    def close(self):
+        """接收结束，get 在取完剩余帧后返回 None"""
+        self._closed = True
+        self._event.set()
+
+    async def get(self) -> tuple[int, bytes] | None:
+        """等待并取出最新帧，返回 (帧序号, 帧数据)"""
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._event.clear()
+            await self._event.wait()
+        frame, self._frame = self._frame, None
+        return frame
+
+
+class FairScheduler:
+    """按连接轮转分配推理并发数
+
+    同时运行的任务数不超过 ``capacity``；有空位时按连接轮转放行，每个
+    连接每轮只放行一个等待中的任务。
+    """
+
+    def __init__(self, capacity: int) -> None:
+        self.capacity = max(1, capacity)
+        self._active = 0
+        self._waiters: dict[str, deque[asyncio.Future]] = {}
+        self._rotation: deque[str] = deque()
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        """以 key(连接标识)的名义占用一个推理并发数"""
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, key: str):
+        if self._active < self.capacity and not self._rotation:
+            self._active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            waiters = self._waiters[key] = deque()
+            self._rotation.append(key)
+        waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():  # 已放行但随即被取消，让给下一个
+                self._release()
+            elif future in waiters:  # 仍在排队，移出等待队列
+                waiters.remove(future)
+                if not waiters and self._waiters.get(key) is waiters:
+                    del self._waiters[key]
+                    self._rotation.remove(key)
+            raise
+
+    def _release(self):
+        self._active -= 1
+        while self._active < self.capacity and self._rotation:
+            key = self._rotation.popleft()
+            waiters = self._waiters[key]
+            future = waiters.popleft()
+            if waiters:
+                self._rotation.append(key)  # 还有等待的任务，排到本轮末尾
+            else:
+                del self._waiters[key]
+            if future.cancelled():
+                continue
+            self._active += 1
+            future.set_result(None)
@@ -0,0 +1,105 @@
+"""websocket 视频流的人脸跟踪
+
+同一个人在镜头前停留时，连续帧的检测框高度重叠。每个连接维护一个
+FaceTracker，按 IoU 把当前帧的检测框与已有轨迹关联，已识别的轨迹直接
+沿用上一次的特征向量与检索结果，只有新出现的轨迹、超过刷新间隔的轨迹
+或检测置信度明显提高的轨迹才重新对齐并推理。
+"""
+import itertools
+
+import numpy as np
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """(N, 4) 与 (M, 4) 的 x1, y1, x2, y2 框两两之间的 IoU，返回 (N, M)"""
+    a = boxes_a[:, np.newaxis, :4]
+    b = boxes_b[np.newaxis, :, :4]
+    w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return inter / np.maximum(area_a + area_b - inter, 1e-6)
+
+
+class Track:
+    """一条人脸轨迹"""
+
+    def __init__(self, track_id: int, bbox: np.ndarray, confidence: float, now: float) -> None:
+        self.track_id = track_id
+        self.bbox = bbox
+        self.confidence = confidence  # 当前帧的检测置信度
+        self.embedded_confidence = 0.0  # 上一次推理时的检测置信度
+        self.embedded_at = float("-inf")  # 上一次推理的时间
+        self.last_seen = now
+        self.feature: np.ndarray | None = None  # 上一次推理得到的 (1, 512) 特征向量
+        self.result: tuple | None = None  # 上一次检索的 (name, distance)
+
+    def update(self, feature: np.ndarray, result: tuple | None, now: float):
+        """记录新的特征向量与检索结果"""
+        self.feature = feature
+        self.result = result
+        self.embedded_confidence = self.confidence
+        self.embedded_at = now
+
+
+class FaceTracker:
+    """按 IoU 关联检测框的轻量跟踪器，每个 websocket 连接一个"""
+
+    def __init__(
+        self,
+        iou_threshold: float = 0.3,
+        refresh_interval: float = 2.0,
+        max_age: float = 1.0,
+        quality_gain: float = 0.05,
+    ) -> None:
+        """
+        Parameters:
+        iou_threshold: 检测框与轨迹关联所需的最小 IoU
+        refresh_interval: 同一轨迹重新推理的间隔(秒)
+        max_age: 轨迹多久未出现后丢弃(秒)
+        quality_gain: 检测置信度比上一次推理时高出该值时重新推理
+        """
+        self.iou_threshold = iou_threshold
+        self.refresh_interval = refresh_interval
+        self.max_age = max_age
+        self.quality_gain = quality_gain
+        self.tracks: list[Track] = []
+        self._ids = itertools.count(1)
+
+    def update(self, confs: np.ndarray, bboxes: np.ndarray, now: float) -> tuple[list[Track], list[int]]:
+        """
+        关联当前帧的检测结果
+        Returns:
+        tuple: (与检测框一一对应的轨迹, 需要重新推理的检测框下标)
+        """
+        self.tracks = [track for track in self.tracks if now - track.last_seen <= self.max_age]
+        bboxes = np.asarray(bboxes, dtype=np.float32)
+        assigned: list[Track | None] = [None] * len(bboxes)
+        if self.tracks and len(bboxes):
+            ious = iou_matrix(bboxes, np.stack([track.bbox for track in self.tracks]))
+            used = set()
+            # 按 IoU 从高到低贪心匹配
+            for flat in np.argsort(-ious, axis=None):
+                det, trk = divmod(int(flat), len(self.tracks))
+                if ious[det, trk] < self.iou_threshold:
+                    break
+                if assigned[det] is not None or trk in used:
+                    continue
+                assigned[det] = self.tracks[trk]
+                used.add(trk)
+        refresh = []
+        for det, (conf, bbox) in enumerate(zip(confs, bboxes)):
+            track = assigned[det]
+            if track is None:
+                track = Track(next(self._ids), bbox, float(conf), now)
+                self.tracks.append(track)
+                assigned[det] = track
+            track.bbox, track.confidence, track.last_seen = bbox, float(conf), now
+            if (
+                track.feature is None
+                or now - track.embedded_at >= self.refresh_interval
+                or track.confidence >= track.embedded_confidence + self.quality_gain
+            ):
+                refresh.append(det)
+        return assigned, refresh
@@ -0,0 +1,134 @@
+"""websocket 二进制协议
+
+连接时通过 ``?protocol=binary`` 协商，之后每条消息为 18 字节的帧头加像素数据::
+
+    format: uint8  flags: uint8  width: uint16  height: uint16  stride: uint32  seq: uint64
+
+format 为 FORMAT_ENCODED(JPEG/PNG 等编码图像，width/height/stride 忽略)、
+FORMAT_BGR、FORMAT_RGB 或 FORMAT_NV12。stride 为每行字节数，0 表示紧密排列。
+BGR 像素通过 np.frombuffer 直接映射为数组，不做复制。
+
+``?reply=msgpack`` 或 ``?reply=struct`` 时结果以二进制返回。struct 格式为::
+
+    seq: uint64  status: uint8  reserved: uint8  count: uint16
+    frame: uint64  dropped: uint64  processed_at: float64
+    count 个人脸: x1, y1, x2, y2: int32  confidence: float32  distance: float32
+                  track_id: int32  name_length: uint16  name: utf-8
+    status 不为 STATUS_OK 时后跟 error_length: uint16  error: utf-8
+
+frame / dropped / processed_at 为最新帧优先与突发模式下的帧序号、累计丢弃帧数与
+处理完成时间(Unix 秒)，其他模式下为 0 / 0 / NaN。
+confidence / distance 为 NaN、track_id 为 -1 表示没有对应的值。
+NV12 帧的宽和高必须为偶数。
+"""
+import math
+import struct
+
+import cv2
+import numpy as np
+
+FORMAT_ENCODED = 0
+FORMAT_BGR = 1
+FORMAT_RGB = 2
+FORMAT_NV12 = 3
+
+STATUS_ERROR = 0
+STATUS_OK = 1
+STATUS_BUSY = 2
+
+FRAME_HEADER = struct.Struct("<BBHHIQ")
+_REPLY_HEADER = struct.Struct("<QBBHQQd")
+_REPLY_FACE = struct.Struct("<4iffiH")
+_TEXT_LENGTH = struct.Struct("<H")
+
+try:
+    import msgpack
+except ImportError:  # 可选依赖，只有 reply=msgpack 时需要
+    msgpack = None
+
+
+def parse_frame(message: bytes) -> tuple[int, bytes | np.ndarray]:
+    """
+    解析一条二进制帧
+    Returns:
+    tuple: (seq, 编码图像字节或 BGR 数组)
+    """
+    if len(message) < FRAME_HEADER.size:
+        raise ValueError("frame is shorter than its header")
+    image_format, _flags, width, height, stride, seq = FRAME_HEADER.unpack_from(message)
+    payload = memoryview(message)[FRAME_HEADER.size :]
+    if image_format == FORMAT_ENCODED:
+        return seq, payload
+    if image_format in (FORMAT_BGR, FORMAT_RGB):
+        stride = stride or width * 3
+        rows = height
+    elif image_format == FORMAT_NV12:
+        stride = stride or width
+        rows = height * 3 // 2  # Y 平面之后是交错的 UV 平面
+    else:
+        raise ValueError(f"unsupported frame format: {image_format}")
+    if width == 0 or height == 0 or stride < (width * 3 if image_format != FORMAT_NV12 else width):
+        raise ValueError("invalid frame size")
+    if image_format == FORMAT_NV12 and (width % 2 or height % 2):  # UV 平面按 2x2 下采样
+        raise ValueError("NV12 frame width and height must be even")
+    if len(payload) < stride * rows:
+        raise ValueError("frame payload is shorter than height * stride")
+    pixels = np.frombuffer(payload, dtype=np.uint8, count=stride * rows).reshape(rows, stride)
+    try:
+        if image_format == FORMAT_NV12:
+            image = np.ascontiguousarray(pixels[:, :width])
+            return seq, cv2.cvtColor(image, cv2.COLOR_YUV2BGR_NV12)
+        image = pixels[:, : width * 3].reshape(height, width, 3)  # 视图，紧密排列时不复制
+        if image_format == FORMAT_RGB:
+            image = cv2.cvtColor(np.ascontiguousarray(image), cv2.COLOR_RGB2BGR)
+    except cv2.error as err:
+        raise ValueError(f"cannot convert frame: {err}") from err
+    return seq, image
+
+
+def _text(value) -> bytes:
+    encoded = str(value).encode()[:65535]
+    return _TEXT_LENGTH.pack(len(encoded)) + encoded
+
+
+def _number(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _msgpack_default(value):
+    if isinstance(value, np.generic):  # 检索结果中的 numpy 标量
+        return value.item()
+    raise TypeError(f"cannot serialize {type(value).__name__}")
+
+
+def pack_reply(payload: dict, seq: int, reply: str) -> bytes:
+    """将识别结果编码为 msgpack 或 struct 二进制"""
+    if reply == "msgpack":
+        if msgpack is None:
+            raise ValueError("reply=msgpack requires the msgpack package")
+        return msgpack.packb({**payload, "seq": seq}, default=_msgpack_default)
+    stream = (
+        payload.get("frame", 0),
+        payload.get("dropped", 0),
+        _number(payload.get("processed_at")),
+    )
+    if payload.get("result") != "True":
+        status = STATUS_BUSY if payload.get("busy") else STATUS_ERROR
+        return _REPLY_HEADER.pack(seq, status, 0, 0, *stream) + _text(payload.get("error", ""))
+    faces = payload.get("faces")
+    if faces is None:  # 单人脸模式
+        faces = [payload]
+    chunks = [_REPLY_HEADER.pack(seq, STATUS_OK, 0, len(faces), *stream)]
+    for face in faces:
+        name = str(face.get("most_similar_face") or "").encode()[:65535]
+        chunks.append(
+            _REPLY_FACE.pack(
+                *(face.get("bbox") or (0, 0, 0, 0)),
+                _number(face.get("confidence")),
+                _number(face.get("distance")),
+                face.get("track_id", -1),
+                len(name),
+            )
+        )
+        chunks.append(name)
+    return b"".join(chunks)
@@ -0,0 +1,72 @@
+"""进程池工作进程
+
+每个工作进程只在初始化时加载一次 Backbone 权重，图像通过
+``multiprocessing.shared_memory`` 从父进程传入，避免 pickle 整张图像。
+"""
+import signal
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from face_hnfnu.AdaFaceFeature import AdaFaceFeature
+from face_hnfnu.Config import ConfigModel, server_config
+
+_ada_face_feature: AdaFaceFeature | None = None
+
+
+def init_worker():
+    """工作进程初始化：忽略 SIGINT 并加载模型"""
+    global _ada_face_feature
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # ignore sigint signal
+    # 多个工作进程共享 CPU 核心，未配置时每个进程只用一个算子内线程
+    config = server_config.model_copy(update={"TORCH_THREADS": server_config.TORCH_THREADS or 1})
+    _ada_face_feature = AdaFaceFeature(config=config).load_pretrained_model()
+
+
+def represent_crops(aligned_bgr_imgs: np.ndarray) -> np.ndarray:
+    """对已对齐的人脸批量推理，返回 (N, 512) 的特征向量"""
+    return _ada_face_feature.batch_get_represent(aligned_bgr_imgs)
+
+
+def init_align_worker(config: ConfigModel):
+    """批量录入的对齐进程初始化：只做解码、检测与对齐，不加载模型"""
+    global _ada_face_feature
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _ada_face_feature = AdaFaceFeature(config=config)
+
+
+def align_files(paths: list[str]) -> list:
+    """
+    读取一组图像文件并对齐其中置信度最高的人脸
+    Returns:
+    list: 每个文件对应 (112, 112, 3) 的 BGR 人脸，失败时为错误信息
+    """
+    results = []
+    for path in paths:
+        try:
+            with open(path, "rb") as file:
+                np_image = _ada_face_feature.decode(file.read())
+            results.append(_ada_face_feature.detect_and_align(np_image))
+        except Exception as err:
+            results.append(str(err))
+    return results
+
+
+def represent_shared(shm_name: str, shape: tuple, dtype: str, multi_face: bool = False):
+    """
+    读取共享内存中的图像，检测、对齐并推理
+    Returns:
+    单人脸模式返回 (1, 512) 的特征向量；多人脸模式返回 (confs, bboxes, features)
+    """
+    shm = SharedMemory(name=shm_name)
+    np_image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    try:
+        confs, bboxes, landmarks = _ada_face_feature.detect_faces(np_image)
+        if not multi_face:
+            confs, bboxes, landmarks = confs[:1], bboxes[:1], landmarks[:1]
+        aligned_bgr_imgs = _ada_face_feature.align_faces(np_image, bboxes, landmarks)
+    finally:
+        del np_image  # 释放对共享内存的引用后才能 close
+        shm.close()
+    features = _ada_face_feature.batch_get_represent(aligned_bgr_imgs)
+    return (confs, bboxes, features) if multi_face else features
@@ -1,15 +1,25 @@
 from pathlib import Path
 from face_hnfnu.Config import server_config as config
+from face_hnfnu.log import logger
 from httpx import AsyncClient
 import asyncio
 
+CHUNK_SIZE = 64
+
 async def register():
     url=f"http://{config.WEB_SERVER_HOST}:{config.WEB_SERVER_PORT}"
     DIR_PATH = Path.cwd() / "test_reg"
-    for img_path in DIR_PATH.iterdir():
-        for img in img_path.glob("*.jpg"):
-            async with AsyncClient() as client:
-                await client.post(f"{url}/add_face", files={"file": (img.as_posix(), img.read_bytes(), "image/jpeg")})
+    #人脸 id 为 "<人名目录>/<文件名>"，服务端以目录名作为身份
+    images = sorted(DIR_PATH.glob("*/*.jpg"))
+    async with AsyncClient(timeout=None) as client:
+        for i in range(0, len(images), CHUNK_SIZE):
+            files = [
+                ("files", (img.relative_to(DIR_PATH).as_posix(), img.read_bytes(), "image/jpeg"))
+                for img in images[i : i + CHUNK_SIZE]
+            ]
+            response = await client.post(f"{url}/add_faces", files=files)
+            for failure in response.json().get("failed", []):
+                logger.warning(f"add face {failure['face_id']} failed: {failure['error']}")
 
 if __name__ == "__main__":
-    asyncio.run(register())
\ No newline at end of file
+    asyncio.run(register())
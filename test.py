@@ -21,10 +21,11 @@ async def test():
         else:
             logger.warning(response.json()["error"])
     
-    #删除测试
-    img_id = Path.cwd() / "test_reg" / "fbeff_109.73.jpg"
+    #删除测试：人脸 id 与 register.py 一致，为 "<人名目录>/<文件名>"
+    reg_path = Path.cwd() / "test_reg"
+    img_id = sorted(reg_path.glob("*/*.jpg"))[0].relative_to(reg_path).as_posix()
     async with AsyncClient() as client:
-        response = await client.post(f"{url}/remove_face", params={"face_id": img_id.as_posix()})
+        response = await client.post(f"{url}/remove_face", params={"face_id": img_id})
         await asyncio.sleep(1)
 
     async with AsyncClient() as client:
@@ -87,6 +88,33 @@ async def test_stress_only():
     end_time = time.time()
     logger.warning(f"Finished stress test in {end_time - start_time} seconds")
 
+async def test_mixed_load():
+    url=f"http://{config.WEB_SERVER_HOST}:{config.WEB_SERVER_PORT}"
+
+    #混合读写压力测试：并发检索的同时反复录入、删除同一张人脸
+    img_path = Path.cwd() / "test" / "test.jpg"
+    content = img_path.read_bytes()
+    start_time = time.time()
+    async with AsyncClient(timeout=60) as client:
+        async def verify_loop():
+            for i in range(50):
+                response = await client.post(f"{url}/verify", files={"file": (img_path.as_posix(), content, "image/jpeg")})
+                if response.status_code != 503 and "most_similar_face" not in response.json() and response.json()["error"] != "No similar face found":
+                    logger.error(f"verify failed: {response.json()['error']}")
+        async def write_loop(worker):
+            for i in range(20):
+                face_id = f"mixed_{worker}_{i}.jpg"
+                response = await client.post(f"{url}/add_face", files={"file": (face_id, content, "image/jpeg")})
+                if response.json()["result"] != "True":
+                    logger.error(f"add face failed: {response.json()['error']}")
+                    continue
+                response = await client.post(f"{url}/remove_face", params={"face_id": face_id})
+                if response.json()["result"] != "True":
+                    logger.error(f"remove face failed: {response.json()['error']}")
+        await asyncio.gather(*[verify_loop() for _ in range(8)], *[write_loop(i) for i in range(4)])
+    end_time = time.time()
+    logger.warning(f"Finished mixed load test in {end_time - start_time} seconds")
+
 async def verify(url, img_path):
     async with asyncio.Semaphore(10):
         async with AsyncClient() as client:
@@ -0,0 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from face_hnfnu.Config import ConfigModel
+from face_hnfnu.FaceDatabase import FaceDatabase
+
+
+@pytest.fixture
+def make_database(tmp_path):
+    databases = []
+
+    def make(**overrides) -> FaceDatabase:
+        config = ConfigModel().model_copy(
+            update={
+                "FAISS_DATABASE_PATH": (tmp_path / "face_db.index").as_posix(),
+                "INDEX_DATABASE_PATH": (tmp_path / "face_db.sqlite").as_posix(),
+                **overrides,
+            }
+        )
+        database = FaceDatabase(config=config)
+        databases.append(database)
+        return database
+
+    yield make
+    for database in databases:
+        database.close()
+
+
+def unit_vectors(count: int, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, 512)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_concurrent_search_with_tombstones(make_database):
+    """并发检索全程都有墓碑，同时还有写入线程继续删除，检索结果不能错位"""
+    face_db = make_database(INDEX_FACTORY="Flat", COMPACT_TOMBSTONES=10**9)
+    vectors = unit_vectors(3000)
+    names = [f"face_{i}" for i in range(len(vectors))]
+    face_db.addFaces(names, vectors)
+    removed = set(range(0, len(vectors), 3))
+    face_db.removeFacesByIds([names[i] for i in removed])
+    late_removed = set(range(1, len(vectors), 7)) - removed
+    done = threading.Event()
+
+    def read(seed: int) -> list:
+        rng = np.random.default_rng(seed)
+        mismatches = []
+        while not done.is_set():
+            rows = rng.integers(len(vectors), size=32)
+            for i, result in zip(rows, face_db.searchSimilarFacesBatch(vectors[rows], 0.99)):
+                if i in removed:
+                    expected = (None,)
+                elif i in late_removed:
+                    expected = (None, names[i])  # 取决于与删除线程的先后
+                else:
+                    expected = (names[i],)
+                if (result and result[0]) not in expected:
+                    mismatches.append((int(i), result))
+        return mismatches
+
+    def remove():
+        for i in sorted(late_removed):
+            face_db.removeFaceById(names[i])
+
+    with ThreadPoolExecutor(9) as pool:
+        readers = [pool.submit(read, seed) for seed in range(8)]
+        pool.submit(remove).result()
+        done.set()
+        mismatches = [mismatch for reader in readers for mismatch in reader.result()]
+
+    assert not mismatches, mismatches[:10]
+    alive = set(range(len(vectors))) - removed - late_removed
+    assert len(face_db) == len(alive)
+    assert set(face_db.name_to_id) == {names[i] for i in alive}
+
+
+def test_compaction_removes_tombstones_in_place(make_database):
+    """Flat 索引压缩时直接删除向量，不重建，检索结果不变"""
+    face_db = make_database(INDEX_FACTORY="Flat", COMPACT_TOMBSTONES=10**9)
+    vectors = unit_vectors(200, seed=1)
+    names = [f"face_{i}" for i in range(len(vectors))]
+    face_db.addFaces(names, vectors)
+    removed = set(range(0, len(vectors), 4))
+    face_db.removeFacesByIds([names[i] for i in removed])
+    index = face_db.faiss
+
+    face_db.compactDatabase()
+
+    assert face_db.faiss is index
+    assert not face_db.tombstones
+    assert face_db.faiss.ntotal == len(vectors) - len(removed)
+    for i, result in enumerate(face_db.searchSimilarFacesBatch(vectors, 0.99)):
+        assert (result and result[0]) == (None if i in removed else names[i])
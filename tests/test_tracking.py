@@ -0,0 +1,26 @@
+import numpy as np
+
+from face_hnfnu.tracking import FaceTracker, iou_matrix
+
+
+def test_iou_matrix_uses_corner_boxes():
+    boxes = np.array([[100, 50, 160, 130], [130, 50, 190, 130]], dtype=np.float32)
+    ious = iou_matrix(boxes, boxes)
+    assert np.allclose(np.diag(ious), 1.0)
+    assert np.isclose(ious[0, 1], 30 * 80 / (2 * 60 * 80 - 30 * 80))
+
+
+def test_still_face_keeps_its_track():
+    tracker = FaceTracker(iou_threshold=0.3, refresh_interval=2.0, max_age=1.0)
+    # x1 大于宽度时，按 x, y, w, h 误算 IoU 会得到 0
+    bbox = np.array([[300, 120, 380, 220]], dtype=np.float32)
+    confs = np.array([0.9], dtype=np.float32)
+
+    tracks, refresh = tracker.update(confs, bbox, now=0.0)
+    assert refresh == [0]
+    tracks[0].update(np.zeros((1, 512), dtype=np.float32), ("alice", 0.8), now=0.0)
+
+    next_tracks, next_refresh = tracker.update(confs, bbox + 2, now=0.1)
+    assert next_tracks[0].track_id == tracks[0].track_id
+    assert next_refresh == []
+    assert len(tracker.tracks) == 1
@@ -0,0 +1,42 @@
+import math
+
+import numpy as np
+import pytest
+
+from face_hnfnu import wire
+
+
+def test_odd_nv12_frame_is_rejected():
+    width = height = 5
+    message = wire.FRAME_HEADER.pack(wire.FORMAT_NV12, 0, width, height, 0, 7) + bytes(
+        width * (height * 3 // 2 + 1)
+    )
+    with pytest.raises(ValueError):
+        wire.parse_frame(message)
+
+
+def test_bgr_frame_is_a_view():
+    pixels = np.arange(4 * 2 * 3, dtype=np.uint8)
+    seq, image = wire.parse_frame(wire.FRAME_HEADER.pack(wire.FORMAT_BGR, 0, 4, 2, 0, 9) + pixels.tobytes())
+    assert seq == 9
+    assert image.shape == (2, 4, 3)
+    assert np.array_equal(image.ravel(), pixels)
+
+
+def test_struct_reply_keeps_stream_fields():
+    payload = {
+        "result": "True",
+        "most_similar_face": "alice",
+        "distance": 0.5,
+        "frame": 12,
+        "dropped": 3,
+        "processed_at": 1700000000.25,
+    }
+    reply = wire.pack_reply(payload, 42, "struct")
+    seq, status, _, count, frame, dropped, processed_at = wire._REPLY_HEADER.unpack_from(reply)
+    assert (seq, status, count, frame, dropped, processed_at) == (42, wire.STATUS_OK, 1, 12, 3, 1700000000.25)
+
+    error = wire.pack_reply({"result": "False", "error": "busy", "busy": True}, 1, "struct")
+    *_, frame, dropped, processed_at = wire._REPLY_HEADER.unpack_from(error)
+    assert wire._REPLY_HEADER.unpack_from(error)[1] == wire.STATUS_BUSY
+    assert (frame, dropped) == (0, 0) and math.isnan(processed_at)